@@ -0,0 +1,88 @@
+import numpy as np
+
+
+#acc and ori are aligned at single instants (the release), by timestamp: the
+#windows themselves stay on their own sensor clocks, resample() moves any
+#instant or grid of one stream onto the other when needed.
+
+def locate(t, when):
+    '''index of the last sample at or before `when`, -1 if every sample is later'''
+    return int(np.searchsorted(t, when, 'right')) - 1
+
+
+def resample(t, values, grid, period=None):
+    '''
+    Linear interpolation of (axes, n) samples taken at sorted timestamps t
+    onto the timestamps in grid, clamped at both ends. With a period (e.g. 360
+    for angles in degrees) neighbours are interpolated the short way round.
+    '''
+    grid = np.asarray(grid)
+    hi = np.clip(np.searchsorted(t, grid, 'left'), 1, len(t) - 1)
+    lo = hi - 1
+    span = (t[hi] - t[lo]).astype(np.float64)
+    w = np.clip((grid - t[lo]) / np.where(span > 0, span, 1), 0, 1)
+
+    v0 = values[:, lo]
+    delta = values[:, hi] - v0
+    if period is None:
+        return v0 + w * delta
+    half = period / 2
+    delta = (delta + half) % period - half
+    return (v0 + w * delta + half) % period - half
+
+
+def release_index(points, peak_idx, min_seg=3):
+    '''
+    Change point estimate of the release instant: split the acceleration
+    deviation before the peak into a quiet hold and a loud release segment so
+    that the squared error of both segment means is minimal.
+    '''
+    mag = np.sqrt((points[:, :peak_idx + 1].astype(np.float64) ** 2).sum(axis=0))
+    n = len(mag)
+    if n < 2 * min_seg:
+        return peak_idx
+    x = np.abs(mag - np.median(mag[:n // 2]))
+
+    s = np.cumsum(x)
+    k = np.arange(min_seg, n - min_seg + 1)
+    left = s[k - 1]
+    right = s[-1] - left
+    #total sum of squares is constant, maximize the explained part instead
+    gain = left ** 2 / k + right ** 2 / (n - k)
+    return int(k[np.argmax(gain)])
+
+
+def release_indices(points, peak_idx, min_seg=3):
+    '''release_index for a batch of (shots, axes, n) windows, peak_idx: (shots,)'''
+    mag = np.sqrt((points.astype(np.float64) ** 2).sum(axis=1))
+    rows, n_max = mag.shape
+    col = np.arange(n_max)
+    n = np.asarray(peak_idx) + 1
+
+    quiet = np.where(col < np.maximum(n // 2, 1)[:, None], mag, np.nan)
+    x = np.where(col < n[:, None], np.abs(mag - np.nanmedian(quiet, axis=1)[:, None]), 0)
+    s = np.cumsum(x, axis=1)
+    k = col[1:]
+    left = s[:, :-1]
+    right = s[np.arange(rows), n - 1][:, None] - left
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gain = left ** 2 / k + right ** 2 / (n[:, None] - k)
+    gain = np.where((k >= min_seg) & (k <= n[:, None] - min_seg), gain, -np.inf)
+    return np.where(n >= 2 * min_seg, k[np.argmax(gain, axis=1)], n - 1)
+
+
+def resample_at(t, values, when, period=None):
+    '''resample for a batch: (shots, n) timestamps, (shots, axes, n) values, one timestamp per shot'''
+    rows = np.arange(len(t))
+    hi = np.clip((t < np.asarray(when)[:, None]).sum(axis=1), 1, t.shape[1] - 1)
+    lo = hi - 1
+    span = (t[rows, hi] - t[rows, lo]).astype(np.float64)
+    w = np.clip((when - t[rows, lo]) / np.where(span > 0, span, 1), 0, 1)[:, None]
+
+    v0 = values[rows, :, lo]
+    delta = values[rows, :, hi] - v0
+    if period is None:
+        return v0 + w * delta
+    half = period / 2
+    delta = (delta + half) % period - half
+    return (v0 + w * delta + half) % period - half
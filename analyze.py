@@ -0,0 +1,225 @@
+'''
+Offline shot analytics over the local shot archive or an InfluxDB CSV export.
+
+    python analyze.py --archive ~/.smartbow/archive --sessions sessions.csv
+    python analyze.py --csv export.csv --shots shots.csv --jobs 8
+
+Per shot: hold std per axis (scaled like the live screen), pre-release
+drift, peak acceleration and the orientation at release. Per session
+(device and day): shot counts and distributions of the above. Sessions are
+analyzed in parallel, each one as a batch of NumPy arrays.
+'''
+import os
+import sys
+import csv
+import glob
+import argparse
+import datetime
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from config import *
+from archive import ShotArchive
+from align import release_indices, resample_at
+from pipeline import Pipeline
+import window
+
+SHOT_GAP_NS = 1_000_000_000 #samples further apart start a new shot in a CSV export
+
+SHOT_FIELDS = (['time', 'peak', 'accepted']
+    + [f'std_{label}' for label in Pipeline.labels]
+    + [f'drift_{label}' for label in Pipeline.labels]
+    + [f'hold_{label}' for label in Pipeline.labels])
+
+
+def shot_metrics(shots):
+    '''
+    shots: archive records or a dict with the same fields, time (s,),
+    peak_t (s,), acc_t (s, n), acc (s, 3, n), ori_t (s, m), ori (s, 3, m) degrees
+    returns {field: (s,) array}
+    '''
+    acc_t = shots['acc_t']
+    acc = shots['acc']
+    ori_t = shots['ori_t']
+    ori = shots['ori']
+    rows = np.arange(len(acc_t))
+
+    peak_idx = np.clip((acc_t < shots['peak_t'][:, None]).sum(axis=1), 0, acc_t.shape[1] - 1)
+    release = acc_t[rows, release_indices(acc, peak_idx)] - window.ms(RELEASE_GUARD_MS)
+    hold = resample_at(ori_t, ori, release, period=360)
+    std = window.std_rows(ori_t, ori, release - window.ms(STD_WINDOW_MS), release) * 10 / np.array(Pipeline.resolution_adjust)
+    drift = window.drift_rows(ori_t, ori, release - window.ms(DRIFT_WINDOW_MS), release, period=360)
+    peak = window.peak_rows(acc_t, acc, release, acc_t.max(axis=1))
+
+    out = dict(time=np.asarray(shots['time']), peak=peak, accepted=(std <= STD_MAX).all(axis=1))
+    for i, label in enumerate(Pipeline.labels):
+        out[f'std_{label}'] = std[:, i]
+        out[f'drift_{label}'] = drift[:, i]
+        out[f'hold_{label}'] = hold[:, i]
+    return out
+
+
+def circular_std(degrees):
+    r = np.hypot(np.cos(np.radians(degrees)).mean(), np.sin(np.radians(degrees)).mean())
+    return np.degrees(np.sqrt(-2 * np.log(max(r, 1e-12))))
+
+
+def session_metrics(m):
+    out = dict(shots=len(m['time']), accepted=int(m['accepted'].sum()), peak_mean=float(m['peak'].mean()))
+    for label in Pipeline.labels:
+        std = m[f'std_{label}']
+        out[f'std_{label}_mean'] = float(std.mean())
+        out[f'std_{label}_p90'] = float(np.percentile(std, 90))
+        out[f'drift_{label}_mean_abs'] = float(np.abs(m[f'drift_{label}']).mean())
+        out[f'hold_{label}_spread'] = float(circular_std(m[f'hold_{label}']))
+    return out
+
+
+def analyze(job):
+    '''runs in a pool process. job: (device, day, source) with source an archive slice or a shots dict'''
+    device, day, source = job
+    if isinstance(source, tuple):
+        path, acc_len, ori_len, start, end = source
+        shots = ShotArchive(path, acc_len, ori_len).load(start, end)
+    else:
+        shots = source
+    m = shot_metrics(shots)
+    return device, day, m, session_metrics(m)
+
+
+def day_of(time_ns):
+    return datetime.date.fromtimestamp(time_ns / 1e9)
+
+
+def archive_jobs(root):
+    #one job per device directory, record layout and day; workers memory-map their own slice
+    jobs = []
+    for name in sorted(glob.glob(os.path.join(root, '**', 'shots-*x*.bin'), recursive=True)):
+        path = os.path.dirname(name)
+        acc_len, ori_len = (int(n) for n in os.path.basename(name)[len('shots-'):-len('.bin')].split('x'))
+        index = ShotArchive(path, acc_len, ori_len).index
+        device = os.path.relpath(path, root) if path != root else 'local'
+        days = defaultdict(list)
+        for t in index:
+            days[day_of(t)].append(t)
+        for day, times in sorted(days.items()):
+            jobs.append((device, day, (path, acc_len, ori_len, times[0], times[-1] + 1)))
+    return jobs
+
+
+def read_csv(files):
+    '''
+    InfluxDB annotated CSV (_time, _value, _field, _measurement, id, idx
+    columns) -> {(id, measurement, field or idx): (times, values)}
+    '''
+    series = defaultdict(lambda: ([], []))
+    for name in files:
+        with open(name, newline='') as f:
+            columns = None
+            for row in csv.reader(f):
+                if not row or row[0].startswith('#'):
+                    columns = None #a header follows the annotations / blank line of every table
+                    continue
+                if columns is None:
+                    columns = {c: i for i, c in enumerate(row)}
+                    continue
+                measurement = row[columns['_measurement']]
+                key = row[columns['idx']] if measurement in ('acceleration', 'orientation') else row[columns['_field']]
+                times, values = series[(row[columns['id']], measurement, key)]
+                times.append(row[columns['_time']].rstrip('Z'))
+                values.append(float(row[columns['_value']]))
+    return {key: (np.array(times, dtype='datetime64[ns]').astype(np.int64), np.array(values)) for key, (times, values) in series.items()}
+
+
+def split_windows(t, values, n_axes=3):
+    '''(time, value) samples of one axis per series -> list of (t, (axes, n)) shot windows'''
+    order = [np.argsort(t[i], kind='stable') for i in range(n_axes)]
+    t = [t[i][order[i]] for i in range(n_axes)]
+    values = [values[i][order[i]] for i in range(n_axes)]
+    cuts = np.flatnonzero(np.diff(t[0]) > SHOT_GAP_NS) + 1
+    return list(zip(np.split(t[0], cuts), (np.stack(v) for v in zip(*(np.split(v, cuts) for v in values)))))
+
+
+def pad(windows, length):
+    #shots of one session into (s, n) / (s, 3, n); padding never falls inside a window
+    t = np.full((len(windows), length), np.iinfo(np.int64).max)
+    v = np.zeros((len(windows), 3, length), dtype=np.float32)
+    for i, (ts, vs) in enumerate(windows):
+        t[i, :len(ts)] = ts
+        v[i, :, :len(ts)] = vs
+    return t, v
+
+
+def csv_jobs(files):
+    series = read_csv(files)
+    jobs = []
+    for device in sorted({key[0] for key in series}):
+        def get(measurement):
+            keys = [(device, measurement, str(i)) for i in range(3)]
+            if not all(k in series for k in keys):
+                return []
+            return split_windows([series[k][0] for k in keys], [series[k][1] for k in keys])
+        acc = get('acceleration')
+        ori = get('orientation')
+        events = series.get((device, 'event', 'value'), (np.zeros(0, dtype=np.int64), None))[0]
+        if not acc or not ori or not len(events):
+            continue
+
+        #pair windows with the event: the acceleration peak sits exactly at the event time
+        acc_start = np.array([w[0][0] for w in acc])
+        ori_start = np.array([w[0][0] for w in ori])
+        shots = defaultdict(list)
+        for event_time in np.sort(events):
+            a = acc[max(np.searchsorted(acc_start, event_time, 'right') - 1, 0)]
+            o = ori[max(np.searchsorted(ori_start, event_time + SHOT_GAP_NS, 'right') - 1, 0)]
+            if not a[0][0] <= event_time <= a[0][-1] or o[0][-1] < event_time - SHOT_GAP_NS:
+                continue
+            shots[day_of(event_time)].append((event_time, a, o))
+
+        for day, day_shots in sorted(shots.items()):
+            acc_t, acc_v = pad([a for _, a, _ in day_shots], max(len(a[0]) for _, a, _ in day_shots))
+            ori_t, ori_v = pad([o for _, _, o in day_shots], max(len(o[0]) for _, _, o in day_shots))
+            time = np.array([t for t, _, _ in day_shots], dtype=np.int64)
+            jobs.append((device, day, dict(time=time, peak_t=time, acc_t=acc_t, acc=acc_v, ori_t=ori_t, ori=ori_v)))
+    return jobs
+
+
+def write_csv(name, fields, rows):
+    with open(name, 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(fields)
+        w.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--archive', help='shot archive directory (searched recursively, e.g. an ingest server archive)')
+    parser.add_argument('--csv', nargs='+', default=[], help='InfluxDB CSV exports')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--shots', help='write per shot metrics to this csv')
+    parser.add_argument('--sessions', help='write per session metrics to this csv')
+    args = parser.parse_args(argv)
+    if not args.archive and not args.csv:
+        parser.error('give --archive and/or --csv')
+
+    jobs = (archive_jobs(args.archive) if args.archive else []) + csv_jobs(args.csv)
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(analyze, jobs))
+
+    session_fields = ['device', 'day'] + (list(results[0][3]) if results else [])
+    print(f"{'device':20} {'day':10} {'shots':>6} {'ok':>6} " + ' '.join(f'{"std " + label[:5]:>10}' for label in Pipeline.labels))
+    for device, day, _, s in results:
+        print(f"{device[:20]:20} {day} {s['shots']:6d} {s['accepted']:6d} " + ' '.join(f"{s[f'std_{label}_mean']:10.2f}" for label in Pipeline.labels))
+
+    if args.sessions:
+        write_csv(args.sessions, session_fields, ([device, day] + list(s.values()) for device, day, _, s in results))
+    if args.shots:
+        rows = []
+        for device, day, m, _ in results:
+            rows += [[device, day] + list(r) for r in zip(*(m[field] for field in SHOT_FIELDS))]
+        write_csv(args.shots, ['device', 'day'] + SHOT_FIELDS, rows)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
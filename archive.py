@@ -0,0 +1,99 @@
+import os
+import glob
+import numpy as np
+
+
+def shot_dtype(acc_len, ori_len):
+    return np.dtype([
+        ('time', '<i8'),                #event time, epoch ns
+        ('peak_t', '<i8'),              #accelerometer peak, sensor clock ns
+        ('acc_t', '<i8', (acc_len,)),
+        ('acc', '<f4', (3, acc_len)),
+        ('ori_t', '<i8', (ori_len,)),
+        ('ori', '<f4', (3, ori_len)),   #degrees
+    ])
+
+
+class ShotArchive:
+    '''
+    Local archive of per-shot raw windows.
+    Shots are fixed width records in shots-<acc_len>x<ori_len>.bin, so the
+    whole file can be memory-mapped as one structured array. The .idx file
+    holds only the shot times and is the index used for range lookups.
+    '''
+
+    def __init__(self, path, acc_len, ori_len):
+        os.makedirs(path, exist_ok=True)
+        self.dtype = shot_dtype(acc_len, ori_len)
+        base = os.path.join(path, f'shots-{acc_len}x{ori_len}')
+        self.data_file = base + '.bin'
+        self.index_file = base + '.idx'
+
+        #drop a record that was torn by a crash
+        n = self._count()
+        for name, size in ((self.data_file, self.dtype.itemsize), (self.index_file, 8)):
+            if os.path.isfile(name) and os.path.getsize(name) != n * size:
+                with open(name, 'r+b') as f:
+                    f.truncate(n * size)
+        self.index = np.fromfile(self.index_file, dtype='<i8') if n else np.zeros(0, dtype='<i8')
+
+    def _count(self):
+        sizes = [os.path.getsize(name) // size if os.path.isfile(name) else 0
+                 for name, size in ((self.data_file, self.dtype.itemsize), (self.index_file, 8))]
+        return min(sizes)
+
+    def __len__(self):
+        return len(self.index)
+
+    def append(self, event_time, peak_t, acc_points, acc_points_t, points, points_t):
+        rec = np.zeros(1, dtype=self.dtype)
+        rec['time'] = event_time
+        rec['peak_t'] = peak_t
+        rec['acc_t'] = acc_points_t
+        rec['acc'] = acc_points
+        rec['ori_t'] = points_t
+        rec['ori'] = points
+        with open(self.data_file, 'ab') as f:
+            rec.tofile(f)
+        with open(self.index_file, 'ab') as f:
+            np.int64(event_time).tofile(f)
+        self.index = np.append(self.index, np.int64(event_time))
+
+    def load(self, start=None, end=None):
+        '''memory-mapped records with start <= time < end'''
+        n = len(self.index)
+        if n == 0:
+            return np.zeros(0, dtype=self.dtype)
+        lo = 0 if start is None else np.searchsorted(self.index, start, 'left')
+        hi = n if end is None else np.searchsorted(self.index, end, 'left')
+        shots = np.memmap(self.data_file, dtype=self.dtype, mode='r', shape=(n,))
+        return shots[lo:hi]
+
+
+class ShotArchives:
+    '''
+    The ShotArchive of every record layout under one directory, opened on
+    the first shot with that layout. Orientation windows are
+    FUSED_BUFFER_LEN long with GYRO_FUSION, and the buffer lengths can
+    change between app versions.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.archives = {} #(acc_len, ori_len): ShotArchive
+
+    def append(self, event_time, peak_t, acc_points, acc_points_t, points, points_t):
+        key = (acc_points.shape[1], points.shape[1])
+        archive = self.archives.get(key)
+        if archive is None:
+            archive = self.archives[key] = ShotArchive(self.path, *key)
+        archive.append(event_time, peak_t, acc_points, acc_points_t, points, points_t)
+
+
+def open_archives(path):
+    #every record layout found in path, e.g. after the buffer lengths were changed
+    archives = []
+    for name in sorted(glob.glob(os.path.join(path, 'shots-*x*.bin'))):
+        acc_len, ori_len = os.path.basename(name)[len('shots-'):-len('.bin')].split('x')
+        archives.append(ShotArchive(path, int(acc_len), int(ori_len)))
+    return archives
@@ -0,0 +1,207 @@
+'''
+Headless benchmark of the per-tick processing path (pipeline.Pipeline.tick):
+sensor snapshot, shot detection, std window and the Worker queue hand-off.
+
+    python bench.py                         #run the default matrix
+    python bench.py --save bench.json       #store a baseline
+    python bench.py --baseline bench.json   #compare against a baseline
+'''
+import sys
+import json
+import time
+import argparse
+import resource
+import threading
+import tracemalloc
+from queue import Queue, Empty
+import numpy as np
+
+from config import *
+from ring import RingBuffer
+from pipeline import Pipeline
+from fusion import MagOrientation, GyroOrientation
+
+
+class Source:
+    #stand-in for a sensor listener, fed synchronously by the benchmark
+    def __init__(self, rate, buffer_len):
+        self.rate = rate
+        self.accuracy = 3
+        self.lock = threading.Lock()
+        self.q = RingBuffer(buffer_len, 3)
+        self.tq = RingBuffer(buffer_len, dtype=np.int64)
+        self.t = 0
+        self.carry = 0.0
+
+    def feed(self, rng, dt, scale, shot=False):
+        self.carry += self.rate * dt
+        n = int(self.carry)
+        self.carry -= n
+        if n == 0:
+            return
+        values = rng.normal(0, scale, (3, n)).astype(np.float32)
+        if shot:
+            values[1, n // 2] = EVENT_THRESH * 2
+        t = self.t + (np.arange(1, n + 1) * (1e9 / self.rate)).astype(np.int64)
+        self.t = int(t[-1])
+        with self.lock:
+            self.q.extend(values)
+            self.tq.extend(t)
+
+    def update(self):
+        pass
+
+
+class MagSource(Source):
+    #raw magnetometer stream, turned into orientation by fusion.MagOrientation
+    def __init__(self, rate, buffer_len, acc):
+        super().__init__(rate, buffer_len)
+        self.acc = acc
+        self.fusion = MagOrientation(buffer_len)
+
+    def feed(self, rng, dt, scale, shot=False):
+        self.carry += self.rate * dt
+        n = int(self.carry)
+        self.carry -= n
+        for _ in range(n):
+            self.t += int(1e9 / self.rate)
+            self.fusion.push(rng.normal((0, 20, -40), scale * 100), self.t)
+
+    def update(self):
+        self.fusion.update(self.acc, self)
+
+
+class GyroSource(Source):
+    #orientation at the accelerometer rate from a gyroscope stream, see compat.Fused
+    def __init__(self, buffer_len, acc):
+        super().__init__(acc.rate, buffer_len)
+        self.acc = acc
+        self.gyr = Source(acc.rate, acc.q.capacity)
+        self.fusion = GyroOrientation()
+
+    def feed(self, rng, dt, scale, shot=False):
+        self.gyr.feed(rng, dt, scale)
+
+    def update(self):
+        self.fusion.update(self.acc, self.gyr, self)
+
+
+class Sensors:
+    def __init__(self, acc, ori):
+        self.acc = acc
+        self.ori = ori
+
+    def update(self):
+        self.ori.update()
+
+
+def drain(q):
+    while True:
+        try:
+            q.get_nowait()
+        except Empty:
+            return
+
+
+def run(acc_len, ori_len, acc_rate, ori_rate, ticks, poll_rate=POLL_RATE, seed=0, raw_mag=False, gyro=False):
+    rng = np.random.default_rng(seed)
+    acc = Source(acc_rate, acc_len)
+    if gyro:
+        ori = GyroSource(ori_len, acc)
+    elif raw_mag:
+        ori = MagSource(ori_rate, ori_len, acc)
+    else:
+        ori = Source(ori_rate, ori_len)
+    sensors = Sensors(acc, ori)
+    q = Queue()
+    pipeline = Pipeline(sensors, q)
+    shot_every = int((GRAPH_FREEZE + 1) / poll_rate)
+    poll_ns = int(poll_rate * 1e9)
+
+    def step(i):
+        sensors.acc.feed(rng, poll_rate, 2, shot=(i % shot_every == shot_every - 1))
+        sensors.ori.feed(rng, poll_rate, 0.001)
+        return i * poll_ns
+
+    #warm up so the buffers hold real data
+    for i in range(max(acc_len // max(int(acc_rate * poll_rate), 1), 1) + 1):
+        pipeline.tick(step(i))
+    drain(q)
+
+    lat = np.zeros(ticks, dtype=np.int64)
+    shots = 0
+    for i in range(ticks):
+        now = step(i + 1000)
+        t0 = time.perf_counter_ns()
+        detected, _, _, _ = pipeline.tick(now)
+        lat[i] = time.perf_counter_ns() - t0
+        shots += detected
+        drain(q)
+
+    #separate pass, tracemalloc slows everything down
+    tracemalloc.start()
+    alloc = []
+    for i in range(min(ticks, 200)):
+        now = step(i + 1000 + ticks)
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        pipeline.tick(now)
+        alloc.append(tracemalloc.get_traced_memory()[1] - base)
+        drain(q)
+    tracemalloc.stop()
+
+    p50, p90, p99 = np.percentile(lat, [50, 90, 99]) / 1e3
+    return dict(
+        p50_us=round(p50, 1), p90_us=round(p90, 1), p99_us=round(p99, 1),
+        max_us=round(lat.max() / 1e3, 1),
+        alloc_kb=round(float(np.mean(alloc)) / 1024, 1),
+        shots=int(shots),
+    )
+
+
+def key(acc_len, ori_len, acc_rate, ori_rate):
+    return f'acc{acc_len}@{acc_rate}/ori{ori_len}@{ori_rate}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ticks', type=int, default=2000)
+    parser.add_argument('--acc-len', type=int, nargs='+', default=[200, ACCELEROMETER_BUFFER_LEN, 800, 1600])
+    parser.add_argument('--ori-len', type=int, nargs='+', default=[100, ORIENTATION_BUFFER_LEN, 400])
+    parser.add_argument('--rates', nargs='+', default=[f'{DEFAULT_ACCELEROMETER_RATE}:{DEFAULT_ORIENTATION_RATE}', '200:50'],
+                        help='acc_rate:ori_rate pairs')
+    parser.add_argument('--raw-mag', action='store_true', help='orientation from raw magnetometer (RAW_MAG)')
+    parser.add_argument('--gyro', action='store_true', help='orientation from gyroscope fusion (GYRO_FUSION), --ori-len counts fused samples')
+    parser.add_argument('--save', help='write results as a baseline json')
+    parser.add_argument('--baseline', help='compare against a saved baseline json')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    print(f"{'config':32} {'p50us':>8} {'p90us':>8} {'p99us':>8} {'maxus':>8} {'allocKB':>8} {'vs base p50':>12}")
+    for rates in args.rates:
+        acc_rate, ori_rate = (int(r) for r in rates.split(':'))
+        for acc_len in args.acc_len:
+            for ori_len in args.ori_len:
+                k = key(acc_len, ori_len, acc_rate, ori_rate)
+                r = run(acc_len, ori_len, acc_rate, ori_rate, args.ticks, raw_mag=args.raw_mag, gyro=args.gyro)
+                results[k] = r
+                diff = ''
+                if k in baseline:
+                    diff = f"{(r['p50_us'] / baseline[k]['p50_us'] - 1) * 100:+.1f}%"
+                print(f"{k:32} {r['p50_us']:8.1f} {r['p90_us']:8.1f} {r['p99_us']:8.1f} {r['max_us']:8.1f} {r['alloc_kb']:8.1f} {diff:>12}")
+
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f'peak rss: {peak_rss_kb / 1024:.1f} MB')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(dict(poll_rate=POLL_RATE, raw_mag=args.raw_mag, gyro=args.gyro, peak_rss_kb=peak_rss_kb, results=results), f, indent=1)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
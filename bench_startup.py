@@ -0,0 +1,62 @@
+'''
+Cold start benchmark.
+
+    python bench_startup.py            #import time of the modules main.py loads, fresh interpreter each
+    python bench_startup.py --app      #also start the app and print the startup.py timeline to the first frame
+
+Import times come from python -X importtime (cumulative, self included),
+the app timeline from the marks in main.py.
+'''
+import os
+import sys
+import argparse
+import subprocess
+import statistics
+
+#what main.py pulls in, in order, plus the upload stack it loads only with a valid config
+MODULES = ['mylog', 'kivy_garden.graph', 'kivymd.app', 'numpy', 'compat', 'pipeline', 'worker', 'influxdb_client', 'urllib3']
+
+
+def import_time(module, repeat):
+    '''median cumulative import time in ms, None if the module is missing'''
+    times = []
+    for _ in range(repeat):
+        r = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                           capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if r.returncode != 0:
+            return None
+        for line in r.stderr.splitlines():
+            #import time: self [us] | cumulative | imported package
+            parts = line.split('|')
+            if len(parts) == 3 and parts[2].strip() == module:
+                times.append(int(parts[1]) / 1e3)
+    return statistics.median(times) if times else None
+
+
+def app_timeline(timeout):
+    env = dict(os.environ, SMARTBOW_STARTUP_BENCH='1')
+    r = subprocess.run([sys.executable, 'main.py'], capture_output=True, text=True, env=env, timeout=timeout,
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
+    return [line for line in r.stdout.splitlines() if line.startswith('startup:')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--app', action='store_true', help='start the app and report the build timeline')
+    parser.add_argument('--timeout', type=float, default=60)
+    args = parser.parse_args(argv)
+
+    print(f"{'module':20} {'import ms':>10}")
+    for module in MODULES:
+        ms = import_time(module, args.repeat)
+        print(f"{module:20} {'missing' if ms is None else f'{ms:10.1f}':>10}")
+
+    if args.app:
+        print(f"\n{'step':25} {'at ms':>8} {'took ms':>8}")
+        lines = app_timeline(args.timeout)
+        print('\n'.join(lines) if lines else 'no startup report, does the app start here?')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,16 @@
 from plyer.utils import platform
 from plyer import storagepath
+import os
 import threading
 import time
-from collections import deque
 from random import random
 from statistics import mean
 import numpy as np
 from kivy.logger import Logger as log
 from copy import deepcopy
+from ring import RingBuffer
+from session import SessionRecorder, read_session
+from fusion import MagOrientation, GyroOrientation
 
 from config import *
 
@@ -45,7 +48,6 @@ class LockScreen():
             return
         self.window.clearFlags(self.params.FLAG_KEEP_SCREEN_ON)
 
-iq = lambda x, m: deque([x] * m, maxlen=m)
 
 if platform == 'android':
     from jnius import PythonJavaClass, java_method, autoclass, cast
@@ -69,9 +71,10 @@ if platform == 'android':
 
             self.cnt = 0
             self.lock = threading.Lock()
+            self.cond = None
             self.rate = default_rate
-            self.q = iq((0.0, 0.0, 0.0), buffer_len)
-            self.tq = iq(0, buffer_len)
+            self.q = RingBuffer(buffer_len, 3)
+            self.tq = RingBuffer(buffer_len, dtype=np.int64)
             self.last_time = 0
 
         def enable(self):
@@ -83,6 +86,10 @@ if platform == 'android':
         def disable(self):
             self.SensorManager.unregisterListener(self, self.sensor)
 
+        def update(self):
+            #called by the pipeline before it takes a snapshot
+            pass
+
         def calc_rate(self, tstamp):
             self.cnt += 1
             diff = tstamp - self.last_time 
@@ -91,6 +98,12 @@ if platform == 'android':
                 self.last_time = tstamp
                 self.cnt = 0
 
+        def wake(self):
+            #let the pipeline thread know new samples are in
+            if self.cond is not None:
+                with self.cond:
+                    self.cond.notify()
+
         @java_method('(Landroid/hardware/Sensor;I)V')
         def onAccuracyChanged(self, sensor, accuracy):
             log.info(f"onAccuracyChanged {self.name} {accuracy}")
@@ -99,55 +112,51 @@ if platform == 'android':
         def __init__(self):
             super().__init__(default_rate=DEFAULT_ACCELEROMETER_RATE, buffer_len = ACCELEROMETER_BUFFER_LEN)
             self.name = 'acc'
-            self.small_q = deque([0.0,0.0,0.0] * SMALLQ_BUFFER_LEN, maxlen=SMALLQ_BUFFER_LEN)
             self.sensor = self.SensorManager.getDefaultSensor(Sensor.TYPE_ACCELEROMETER)
 
         @java_method('(Landroid/hardware/SensorEvent;)V')
         def onSensorChanged(self, event):
             self.accuracy = event.accuracy
             with self.lock:
-                self.small_q.append(event.values)
+                self.q.append(event.values)
+                self.tq.append(event.timestamp)
+            self.calc_rate(event.timestamp)
+            self.wake()
+
+    class GyroscopeSensorListener(SensorListener):
+        #angular rates in rad/s, input of fusion.GyroOrientation
+        def __init__(self):
+            super().__init__(default_rate=DEFAULT_ACCELEROMETER_RATE, buffer_len = ACCELEROMETER_BUFFER_LEN)
+            self.name = 'gyr'
+            self.sensor = self.SensorManager.getDefaultSensor(Sensor.TYPE_GYROSCOPE)
+
+        @java_method('(Landroid/hardware/SensorEvent;)V')
+        def onSensorChanged(self, event):
+            self.accuracy = event.accuracy
+            with self.lock:
                 self.q.append(event.values)
                 self.tq.append(event.timestamp)
             self.calc_rate(event.timestamp)
 
     class MagnetometerSensorListener(SensorListener):
+        #only buffers raw vectors, orientation is computed in batches by update(), see fusion.py
         def __init__(self, acc):
             super().__init__(default_rate=DEFAULT_ORIENTATION_RATE, buffer_len = ORIENTATION_BUFFER_LEN)
             self.name = 'ori'
             self.acc = acc
             self.sensor = self.SensorManager.getDefaultSensor(Sensor.TYPE_MAGNETIC_FIELD)
-            self.rotation = [0.0] * 9
-            self.remapped_rotation = deepcopy(self.rotation)
-            self.values = [0.0] * 3
+            self.fusion = MagOrientation(ORIENTATION_BUFFER_LEN)
 
         @java_method('(Landroid/hardware/SensorEvent;)V')
         def onSensorChanged(self, event):
-
-            #get gravity
-            with self.acc.lock:
-                acc_values = np.array(self.acc.small_q)
-            gravity = list(np.median(acc_values, axis=0))
-
-            self.SensorManager.getRotationMatrix(self.rotation, None, gravity, event.values)
-
-            #from https://developer.android.com/reference/android/hardware/SensorManager#remapCoordinateSystem(float[],%20int,%20int,%20float[]) 
-            #Using the camera (Y axis along the camera's axis) for an augmented reality application where the rotation angles are needed:
-            SensorManager.remapCoordinateSystem(self.rotation, AXIS_X, AXIS_Z, self.remapped_rotation)
-
-            values = deepcopy(self.values)
-            self.SensorManager.getOrientation(self.remapped_rotation, values)
-
-            #flip pitch direction for graph to follow phone movement
-            values[1] = -values[1]
-
-            with self.lock:
-                self.q.append(values)
-                self.tq.append(event.timestamp)
-
+            self.fusion.push(event.values, event.timestamp)
             self.calc_rate(event.timestamp)
+            self.wake()
             self.accuracy = event.accuracy
 
+        def update(self):
+            self.fusion.update(self.acc, self)
+
 
     class OrientationSensorListener(SensorListener):
         def __init__(self):
@@ -175,6 +184,7 @@ if platform == 'android':
                 self.tq.append(event.timestamp)
 
             self.calc_rate(event.timestamp)
+            self.wake()
             self.accuracy = event.accuracy
             #log.info(f'accuracy: {event.accuracy} values: {event.values}')
 
@@ -185,10 +195,11 @@ class Dummy:
         self.accuracy = 3
         self.type = type
         self.last_time = time.monotonic_ns()
-        self.q = iq((0.0, 0.0, 0.0), buffer_len)
-        self.tq = iq(0, buffer_len)
+        self.q = RingBuffer(buffer_len, 3)
+        self.tq = RingBuffer(buffer_len, dtype=np.int64)
         self.cnt = 0
         self.lock = threading.Lock()
+        self.cond = None
 
     def enable(self):
         self.run = True
@@ -198,6 +209,9 @@ class Dummy:
     def disable(self):
         self.run = False
 
+    def update(self):
+        pass
+
     def calc_rate(self, tstamp):
         self.cnt += 1
         diff = tstamp - self.last_time 
@@ -206,6 +220,11 @@ class Dummy:
             self.rate = self.cnt / diff * 1e9
             self.cnt = 0
 
+    def wake(self):
+        if self.cond is not None:
+            with self.cond:
+                self.cond.notify()
+
     def do(self):
         while self.run:
             time.sleep(1/self._rate)
@@ -215,38 +234,189 @@ class Dummy:
                 pitch = np.random.uniform(-np.pi/4, np.pi/4)
                 roll = np.random.uniform(-np.pi/4, np.pi/4)
                 data = np.array([azimuth, pitch, roll])
+            elif self.type == 'gyr':
+                data = np.random.normal(0, 0.05, 3)
             else:
                 data = np.array([random() - 2 , random(), random() + 2 ])
-            data = list(data)
             with self.lock:
                 self.q.append(data)
                 self.tq.append(tstamp)
             self.calc_rate(tstamp)
+            self.wake()
+
+class Replay(Dummy):
+    '''
+    One stream of a recorded session, played back by a Playback. The sensor
+    rate is the recorded one scaled by the playback speed.
+    '''
+
+    def __init__(self, playback, type='acc', buffer_len=1):
+        t, self.values = playback.session[type]
+        self.playback = playback
+        self.t = t - playback.t0
+        self.i = 0 #next sample to append
+        super().__init__((len(t) - 1) / max(self.t[-1] - self.t[0], 1) * 1e9 * playback.speed, type=type, buffer_len=buffer_len)
+
+    def enable(self):
+        self.playback.start()
+
+    def disable(self):
+        self.playback.stop()
+
+    def play(self, until, offset):
+        #append the samples recorded up to session time until, timestamps shifted by offset
+        j = int(np.searchsorted(self.t, until, 'right'))
+        if j > self.i:
+            with self.lock:
+                self.q.extend(self.values[:, self.i:j])
+                self.tq.extend(self.t[self.i:j] + offset)
+            self.i = j
+            self.wake()
+
+class Playback:
+    '''
+    Plays back a recorded session, see session.py, as Replay streams.
+    A single thread drives every stream from one clock and appends all of
+    them up to the same session time on each step, so the acc, ori and gyr
+    rings always cover the same span of the recording. Timestamps keep their
+    recorded spacing and are rebased onto the monotonic clock. speed scales
+    the playback pace (2 is twice real time). The session loops at the end.
+    '''
+    step = 0.005 #seconds between appends
+
+    def __init__(self, session, speed=1):
+        if speed <= 0:
+            #the pipeline and the graph freeze run on the wall clock, unpaced playback only overwrites the rings
+            raise ValueError(f'replay speed must be > 0, use redetect.py for whole sessions at once: {speed}')
+        self.session = session
+        self.speed = speed
+        self.t0 = min(ts[0] for ts, _ in session.values())
+        self.duration = max(int(ts[-1]) for ts, _ in session.values()) - self.t0 + 1
+        self.streams = []
+        self.thread = None
+
+    def stream(self, type, buffer_len):
+        replay = Replay(self, type=type, buffer_len=buffer_len)
+        self.streams.append(replay)
+        return replay
+
+    def start(self):
+        #called by every stream, the first one starts the clock
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.do, daemon=True, name='replay')
+            self.thread.start()
+
+    def stop(self):
+        thread, self.thread = self.thread, None
+        if thread is not None:
+            thread.join(1)
+
+    def do(self):
+        me = threading.current_thread()
+        start = time.monotonic_ns()
+        base = 0 #session time at the start of the current loop
+        for replay in self.streams:
+            replay.i = 0
+        while self.thread is me:
+            time.sleep(self.step)
+            now = (time.monotonic_ns() - start) * self.speed
+            while now - base >= self.duration:
+                for replay in self.streams:
+                    replay.play(self.duration, start + base)
+                    replay.i = 0
+                base += self.duration
+            for replay in self.streams:
+                replay.play(now - base, start + base)
+
+class Fused:
+    '''
+    Orientation stream at the accelerometer rate, integrated from a gyroscope
+    stream by fusion.GyroOrientation whenever the pipeline calls update().
+    '''
+
+    def __init__(self, acc, gyr, buffer_len):
+        self.acc = acc
+        self.gyr = gyr
+        self.accuracy = 3
+        self.cond = None
+        self.lock = threading.Lock()
+        self.q = RingBuffer(buffer_len, 3)
+        self.tq = RingBuffer(buffer_len, dtype=np.int64)
+        self.fusion = GyroOrientation()
+
+    @property
+    def rate(self):
+        return self.acc.rate
+
+    def enable(self):
+        self.gyr.enable()
+
+    def disable(self):
+        self.gyr.disable()
+
+    def update(self):
+        self.gyr.update()
+        self.fusion.update(self.acc, self.gyr, self)
 
 class Accelerometer:
     def __init__(self):
         self.started = False
+        self.recorder = None
+        self.cond = threading.Condition() #notified on every new sample
 
     def enable(self):
         if self.started:
             return
         if platform == 'android':
             self.acc = AccelerometerSensorListener()
-            if RAW_MAG:
+            if GYRO_FUSION:
+                self.ori = Fused(self.acc, GyroscopeSensorListener(), FUSED_BUFFER_LEN)
+            elif RAW_MAG:
                 self.ori = MagnetometerSensorListener(self.acc)
             else:
                 self.ori = OrientationSensorListener()
+        elif REPLAY_SESSION:
+            playback = Playback(read_session(REPLAY_SESSION), speed=REPLAY_SPEED)
+            self.acc = playback.stream('acc', ACCELEROMETER_BUFFER_LEN)
+            if GYRO_FUSION and 'gyr' in playback.session:
+                self.ori = Fused(self.acc, playback.stream('gyr', ACCELEROMETER_BUFFER_LEN), FUSED_BUFFER_LEN)
+            else:
+                self.ori = playback.stream('ori', ORIENTATION_BUFFER_LEN)
         else:
             self.acc = Dummy(DEFAULT_ACCELEROMETER_RATE, buffer_len = ACCELEROMETER_BUFFER_LEN)
-            self.ori= Dummy(DEFAULT_ORIENTATION_RATE, type='ori', buffer_len=ORIENTATION_BUFFER_LEN)
+            if GYRO_FUSION:
+                gyr = Dummy(DEFAULT_ACCELEROMETER_RATE, type='gyr', buffer_len=ACCELEROMETER_BUFFER_LEN)
+                self.ori = Fused(self.acc, gyr, FUSED_BUFFER_LEN)
+            else:
+                self.ori= Dummy(DEFAULT_ORIENTATION_RATE, type='ori', buffer_len=ORIENTATION_BUFFER_LEN)
 
+        self.acc.cond = self.cond
+        self.ori.cond = self.cond
         self.acc.enable()
         self.ori.enable()
         self.started = True
 
+        if RECORD_SESSION:
+            path = os.path.join(get_application_dir(), 'sessions')
+            os.makedirs(path, exist_ok=True)
+            path = os.path.join(path, time.strftime('session-%Y%m%d-%H%M%S.sbs'))
+            log.info(f'recording: {path}')
+            streams = dict(acc=self.acc, ori=self.ori)
+            if isinstance(self.ori, Fused):
+                streams['gyr'] = self.ori.gyr
+            self.recorder = SessionRecorder(path, streams)
+            self.recorder.start()
+
+    def update(self):
+        self.acc.update()
+        self.ori.update()
+
     def disable(self):
         if not self.started:
             return
+        if self.recorder is not None:
+            self.recorder.stop()
+            self.recorder = None
         self.acc.disable()
         self.ori.disable()
         self.started = False
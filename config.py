@@ -1,9 +1,15 @@
 EVENT_THRESH = 45 #when to detect an event
 STD_MAX = 15 #stdev above which we skip the event
 
-POLL_RATE = 0.1 #latency on detection vs cpu/usage
+POLL_RATE = 0.1 #initial screen refresh interval, adapted at runtime (scheduler.py), detection runs on its own thread (PIPELINE_INTERVAL)
+POLL_RATE_MIN = 0.03 #fastest screen refresh
+POLL_RATE_MAX = 0.25 #slowest screen refresh
+POLL_MIN_SAMPLES = 3 #do not refresh faster than the sensor delivers this many new samples
+FRAME_BUDGET = 0.15 #fraction of one core the screen refresh may use
+SCHED_BOOST = 1 #seconds of fastest refresh after a shot
 
-GRAPH_DRAW_EVERY_FRAMES = 1 # skip frames, increase on older/slower devices
+GRAPH_DRAW_EVERY_FRAMES = 1 #initial frames per redraw, raised at runtime when drawing does not fit FRAME_BUDGET
+GRAPH_DRAW_MAX_EVERY = 8 #upper limit of frames per redraw
 GRAPH_FREEZE = 4  #how many seconds to freeze graphs after shot is detected:w
 ACCELEROMETER_Y_LIMIT = 150 #acceleromter graph Y-limit
 
@@ -15,9 +21,63 @@ DEFAULT_ORIENTATION_RATE = 100
 ACCELEROMETER_BUFFER_LEN = 400 
 ORIENTATION_BUFFER_LEN =  200
 
-STD_WINDOW_MS = 250  #window for calculating std
+STD_WINDOW_MS = 250  #window before the release for calculating std, selected by sensor timestamps
+DRIFT_WINDOW_MS = 500 #window before the release for the orientation drift
 
 RAW_MAG = False #use raw magnetometer for orientation sensing
-SMALLQ_BUFFER_LEN = 10 #how much of accelerometer to buffer
+SMALLQ_BUFFER_LEN = 10 #accelerometer samples in the gravity median for RAW_MAG
 
+SPOOL_MAX_BYTES = 32 * 1024 * 1024 #disk budget for uploads that failed while offline
+SPOOL_SEGMENT_BYTES = 1024 * 1024 #spooled data is uploaded one segment per request
+SPOOL_BACKOFF_MIN = 5 #seconds between upload retries, doubles on every failure
+SPOOL_BACKOFF_MAX = 300
 
+LOG_FLUSH_INTERVAL = 5 #seconds between batched log uploads
+LOG_BUFFER_LEN = 200 #log records kept between uploads, oldest are dropped first
+
+ARCHIVE_SHOTS = True #keep raw per-shot windows on the device, see archive.py
+
+RECORD_SESSION = False #record every raw sample to <app dir>/sessions, see session.py
+REPLAY_SESSION = '' #desktop only: replay this session file instead of random data
+REPLAY_SPEED = 1 #1 is real time, 2 twice as fast; redetect.py processes whole sessions at once
+
+METRICS_INTERVAL = 60 #seconds between 'perf' stage timing exports to influx
+DEBUG_OVERLAY = False #show stage timings in the toolbar
+
+PIPELINE_INTERVAL = 0.01 #minimum seconds between detection passes on the pipeline thread
+
+RELEASE_GUARD_MS = 20 #orientation this long before the detected release instant is taken as the hold
+RELEASE_TRIM = 7 #fallback: orientation samples to drop when the release cannot be aligned
+
+GYRO_FUSION = False #orientation at accelerometer rate from gyroscope + accelerometer, azimuth is relative
+FUSED_BUFFER_LEN = 1000 #orientation samples kept when GYRO_FUSION is on
+FUSION_KP = 1.0 #tilt correction gain
+FUSION_KI = 0.0 #gyroscope bias correction gain
+
+STABILITY_TRACE_MS = 1500 #pre-shot std trace uploaded with every shot, as far as the orientation buffer reaches
+
+INGEST_PORT = 8087 #ingest server (ingest.py) port
+INGEST_FLUSH_INTERVAL = 2 #seconds the ingest server collects data before a write smaller than INGEST_BATCH_BYTES
+INGEST_BATCH_BYTES = 4 * 1024 * 1024 #ingest server write batch, one spool segment
+INGEST_SPOOL_MAX_BYTES = 256 * 1024 * 1024 #ingest server disk limit while InfluxDB is unreachable
+
+#per stream upload policy, overridable under "upload_policy" in smartbow_config.json:
+#before_ms/after_ms window around the shot, every sample within core_ms of it and every
+#decimate-th outside, values rounded to decimals places (m/s^2 or degrees)
+UPLOAD_POLICY = {
+    'acceleration': dict(before_ms=500, after_ms=200, core_ms=100, decimate=4, decimals=2),
+    'orientation': dict(before_ms=1500, after_ms=200, core_ms=300, decimate=2, decimals=2),
+}
+
+#Worker queue lanes, highest priority first: name, commands, max items (None: never drop), which item
+#to drop when full ('oldest' or 'newest'). 'flush' is delivered once all lanes but the last have drained.
+WORKER_LANES = [
+    ('shot', ['event'], 1024, 'oldest'),
+    ('summary', ['std', 'drift'], 1024, 'oldest'),
+    ('archive', ['archive'], None, 'oldest'), #local disk, kept while uploads stall
+    ('window', ['acceleration', 'orientation', 'stability'], 48, 'oldest'),
+    ('log', ['log'], 1000, 'oldest'),
+]
+
+HISTORY_STD_BIN = 0.25 #std histogram bin width of the history rollups
+HISTORY_STD_BINS = 120 #bins, the last one collects everything above
@@ -0,0 +1,78 @@
+import os
+import glob
+
+
+class CountStore:
+    '''
+    Arrow count per day.
+    Backed by an append-only log of "<day> <count>" lines where the last line
+    for a day wins. The log is read once at startup, afterwards lookups and
+    increments are O(1) in memory plus one appended line per shot.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.counts = {}
+        self.listeners = []
+
+        lines = 0
+        tail = '\n'
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    tail = line[-1:]
+                    lines += 1
+                    try:
+                        day, count = line.split()
+                        if len(day) == 10:
+                            self.counts[day] = int(count)
+                    except ValueError:
+                        pass #torn write
+        if lines > 2 * len(self.counts) + 100:
+            self.compact()
+        self.f = open(path, 'a')
+        if tail != '\n':
+            self.f.write('\n')
+
+    def get(self, day):
+        return self.counts.get(str(day), 0)
+
+    def increment(self, day):
+        day = str(day)
+        count = self.counts.get(day, 0) + 1
+        self.counts[day] = count
+        self.f.write(f'{day} {count}\n')
+        self.f.flush()
+        for func in self.listeners:
+            func(day, count)
+        return count
+
+    def bind(self, func):
+        #func(day, count) is called on every change
+        self.listeners.append(func)
+
+    def compact(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            for day in sorted(self.counts):
+                f.write(f'{day} {self.counts[day]}\n')
+        os.replace(tmp, self.path)
+
+    def import_legacy(self, directory):
+        #pull in the per-day cache-YYYY-MM-DD.pickle files of older releases
+        import pickle #only needed once, on the first start after the upgrade
+        found = False
+        for cache_file in glob.glob(os.path.join(directory, 'cache-*.pickle')):
+            day = os.path.basename(cache_file)[len('cache-'):-len('.pickle')]
+            if day in self.counts:
+                continue
+            try:
+                with open(cache_file, 'rb') as f:
+                    self.counts[day] = pickle.load(f)['event_count']
+                found = True
+            except Exception:
+                pass
+        if found:
+            self.f.close()
+            self.compact()
+            self.f = open(self.path, 'a')
@@ -0,0 +1,45 @@
+import numpy as np
+
+
+class Decimator:
+    '''
+    Min/max decimation of a sample window for plotting. Each bucket of
+    samples is reduced to its min and max, in time order, so a window never
+    yields more than about two points per pixel column and spikes such as
+    the shot stay visible. Scratch arrays are reused between frames.
+
+    Only the returned points are new per frame: Plot.points (kivy_garden.graph)
+    is a ListProperty that copies whatever it gets into a fresh list, and
+    every draw unpacks it point by point in Python, so an array view would
+    still be copied and then draw several times slower on NumPy scalars.
+    '''
+
+    def __init__(self):
+        self.key = None
+
+    def _alloc(self, n, width, dtype):
+        self.key = (n, width, dtype)
+        self.k = max(n // width, 1)
+        self.buckets = n // self.k
+        self.start = n - self.buckets * self.k #oldest samples that do not fill a bucket are skipped
+        self.base = self.start + np.arange(self.buckets) * self.k
+        self.idx = np.empty(2 * self.buckets, dtype=np.intp)
+        self.y = np.empty(2 * self.buckets, dtype=dtype)
+        self.x = list(range(n))
+
+    def __call__(self, values, width):
+        '''returns [(x, y), ...] with x the sample index in values'''
+        n = len(values)
+        width = max(int(width), 1)
+        if self.key != (n, width, values.dtype):
+            self._alloc(n, width, values.dtype)
+        if n <= 2 * width:
+            return list(zip(self.x, values.tolist()))
+
+        block = values[self.start:].reshape(self.buckets, self.k)
+        imin = block.argmin(axis=1)
+        imax = block.argmax(axis=1)
+        np.add(self.base, np.minimum(imin, imax), out=self.idx[0::2])
+        np.add(self.base, np.maximum(imin, imax), out=self.idx[1::2])
+        np.take(values, self.idx, out=self.y)
+        return list(zip(self.idx.tolist(), self.y.tolist()))
@@ -0,0 +1,46 @@
+import numpy as np
+
+from config import *
+
+
+class ShotDetector:
+    '''
+    Streaming shot detector.
+    Keeps a read cursor (RingBuffer.count) into the accelerometer stream and
+    only scans samples that arrived since the previous call. Samples that show
+    up while the detector is frozen after a shot stay unread, so they are
+    still examined once the freeze expires, as long as they are in the window.
+    '''
+
+    def __init__(self, thresh=EVENT_THRESH, freeze=GRAPH_FREEZE):
+        self.thresh = thresh
+        self.freeze_ns = freeze * 1e9
+        self.cursor = 0
+        self.event_time = 0
+        self.event_time_idx = 0
+        self.event_value = 0
+
+    def update(self, this_time_ns, points, count):
+        '''
+        points: (axes, n) snapshot of the stream, newest sample last
+        count: total samples written to the stream when the snapshot was taken
+        '''
+        if (this_time_ns - self.event_time) <= self.freeze_ns:
+            return False
+
+        n = points.shape[1]
+        new = min(count - self.cursor, n)
+        self.cursor = count
+        if new <= 0:
+            return False
+
+        pmax_a = np.abs(points[:, n - new:]).max(axis=0)
+        pmax_i = np.argmax(pmax_a)
+        pmax = pmax_a[pmax_i]
+        if pmax <= self.thresh:
+            return False
+
+        self.event_time = np.int64(this_time_ns)
+        self.event_time_idx = n - new + pmax_i
+        self.event_value = pmax
+        return True
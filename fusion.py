@@ -0,0 +1,216 @@
+import threading
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from config import *
+from ring import RingBuffer
+from align import resample
+
+#SensorManager.getRotationMatrix rejects gravity below 10% of g
+FREE_FALL_GRAVITY_SQUARED = 0.01 * 9.81 * 9.81
+
+
+def rotation_matrix(gravity, geomagnetic):
+    '''
+    Vectorized SensorManager.getRotationMatrix.
+    gravity, geomagnetic: (3, n) device frame vectors
+    returns (n, 3, 3) rotation matrices and a mask of the valid ones
+    '''
+    A = np.asarray(gravity, dtype=np.float64)
+    E = np.asarray(geomagnetic, dtype=np.float64)
+    H = np.cross(E, A, axis=0)
+    norm_h = np.sqrt((H ** 2).sum(axis=0))
+    norm_sq_a = (A ** 2).sum(axis=0)
+    valid = (norm_h >= 0.1) & (norm_sq_a >= FREE_FALL_GRAVITY_SQUARED)
+
+    H = H / np.where(valid, norm_h, 1)
+    A = A / np.sqrt(np.where(valid, norm_sq_a, 1))
+    M = np.cross(A, H, axis=0)
+    return np.stack([H, M, A]).transpose(2, 0, 1), valid
+
+
+def remap_x_z(R):
+    '''SensorManager.remapCoordinateSystem(R, AXIS_X, AXIS_Z), camera along the Y axis'''
+    return np.stack([R[:, :, 0], -R[:, :, 2], R[:, :, 1]], axis=-1)
+
+
+def orientation(R):
+    '''SensorManager.getOrientation: (n, 3, 3) -> (3, n) azimuth, pitch, roll in radians'''
+    return np.stack([
+        np.arctan2(R[:, 0, 1], R[:, 1, 1]),
+        np.arcsin(np.clip(-R[:, 2, 1], -1, 1)),
+        np.arctan2(-R[:, 2, 0], R[:, 2, 2]),
+    ])
+
+
+def gravity_at(acc_t, acc, t, n=SMALLQ_BUFFER_LEN):
+    '''median of the last n accelerometer samples at or before each timestamp in t'''
+    n = min(n, acc.shape[1])
+    windows = sliding_window_view(acc, n, axis=1)
+    start = np.clip(np.searchsorted(acc_t, t, 'right') - n, 0, windows.shape[1] - 1)
+    return np.median(windows[:, start], axis=-1)
+
+
+class MagOrientation:
+    '''
+    Orientation from raw magnetometer plus accelerometer gravity.
+    The sensor callback only buffers raw vectors with push(); update()
+    converts everything buffered since the last call in one vectorized batch
+    and appends the result to the orientation stream.
+    '''
+
+    def __init__(self, buffer_len):
+        self.lock = threading.Lock()
+        self.raw = RingBuffer(buffer_len, 3)
+        self.raw_t = RingBuffer(buffer_len, dtype=np.int64)
+        self.cursor = 0
+
+    def push(self, values, tstamp):
+        with self.lock:
+            self.raw.append(values)
+            self.raw_t.append(tstamp)
+
+    def update(self, acc, out):
+        '''acc: accelerometer stream, out: orientation stream (q/tq/lock)'''
+        with self.lock:
+            n = min(self.raw.count - self.cursor, self.raw.capacity)
+            self.cursor = self.raw.count
+            if n <= 0:
+                return
+            mag = self.raw.tail(n)
+            mag_t = self.raw_t.tail(n)
+
+        with acc.lock:
+            acc_points = acc.q.snapshot()
+            acc_points_t = acc.tq.snapshot()
+
+        gravity = gravity_at(acc_points_t, acc_points, mag_t)
+        R, valid = rotation_matrix(gravity, mag)
+        values = orientation(remap_x_z(R[valid]))
+        #flip pitch direction for graph to follow phone movement
+        values[1] = -values[1]
+
+        with out.lock:
+            out.q.extend(values)
+            out.tq.extend(mag_t[valid])
+
+
+def quat_multiply(p, q):
+    '''Hamilton product of (..., 4) quaternions stored as w, x, y, z'''
+    pw, px, py, pz = p[..., 0], p[..., 1], p[..., 2], p[..., 3]
+    qw, qx, qy, qz = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    out = np.empty(np.broadcast_shapes(p.shape, q.shape))
+    out[..., 0] = pw * qw - px * qx - py * qy - pz * qz
+    out[..., 1] = pw * qx + px * qw + py * qz - pz * qy
+    out[..., 2] = pw * qy - px * qz + py * qw + pz * qx
+    out[..., 3] = pw * qz + px * qy - py * qx + pz * qw
+    return out
+
+
+def quat_cumprod(dq):
+    '''running products dq[0] * ... * dq[k] for every k, as a log2(n) step parallel scan'''
+    P = dq.copy()
+    step = 1
+    while step < len(P):
+        P[step:] = quat_multiply(P[:-step], P[step:])
+        step *= 2
+    return P
+
+
+def quat_matrix(q):
+    '''(n, 4) unit quaternions to (n, 3, 3) body to world rotation matrices'''
+    w, x, y, z = q.T
+    return np.stack([
+        np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)], axis=-1),
+        np.stack([2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)], axis=-1),
+        np.stack([2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)], axis=-1),
+    ], axis=1)
+
+
+def matrix_quat(R):
+    '''(3, 3) rotation matrix to a w, x, y, z quaternion'''
+    #Shepperd: start from the largest component so the division is well conditioned
+    d = np.array([R[0, 0] + R[1, 1] + R[2, 2], R[0, 0], R[1, 1], R[2, 2]])
+    i = int(np.argmax(d))
+    q = np.empty(4)
+    q[i] = np.sqrt(max(1 + 2 * d[i] - d[0], 0)) / 2
+    s = 4 * q[i]
+    if i == 0:
+        q[1:] = (R[2, 1] - R[1, 2]) / s, (R[0, 2] - R[2, 0]) / s, (R[1, 0] - R[0, 1]) / s
+    elif i == 1:
+        q[[0, 2, 3]] = (R[2, 1] - R[1, 2]) / s, (R[0, 1] + R[1, 0]) / s, (R[0, 2] + R[2, 0]) / s
+    elif i == 2:
+        q[[0, 1, 3]] = (R[0, 2] - R[2, 0]) / s, (R[0, 1] + R[1, 0]) / s, (R[1, 2] + R[2, 1]) / s
+    else:
+        q[[0, 1, 2]] = (R[1, 0] - R[0, 1]) / s, (R[0, 2] + R[2, 0]) / s, (R[1, 2] + R[2, 1]) / s
+    return q
+
+
+class GyroOrientation:
+    '''
+    Mahony style attitude filter running at the accelerometer rate.
+    Gyroscope rates are interpolated onto the accelerometer timestamps and
+    integrated with a parallel quaternion scan, so a whole batch of samples
+    costs a handful of NumPy calls. The accelerometer tilt correction is
+    computed once per batch, which is negligible next to the filter time
+    constant. Gravity does not observe heading, so azimuth is relative to
+    the attitude at start-up and drifts with the gyroscope bias.
+    '''
+
+    def __init__(self, kp=FUSION_KP, ki=FUSION_KI):
+        self.kp = kp
+        self.ki = ki
+        self.q = None
+        self.e_int = np.zeros(3)
+        self.cursor = 0
+        self.last_t = 0
+
+    def reset(self, a):
+        #level from gravity, heading from the device Y axis or, with the phone upright, the camera
+        R, valid = rotation_matrix(np.tile(a[:, None], 2), np.array([[0.0, 0.0], [1.0, 0.0], [0.0, -1.0]]))
+        self.q = matrix_quat(R[np.argmax(valid)]) if valid.any() else np.array([1.0, 0.0, 0.0, 0.0])
+
+    def update(self, acc, gyr, out):
+        '''acc, gyr: input streams, out: orientation stream (q/tq/lock)'''
+        with acc.lock:
+            n = min(acc.q.count - self.cursor, acc.q.capacity)
+            self.cursor = acc.q.count
+            if n <= 0:
+                return
+            a = acc.q.tail(n).astype(np.float64)
+            t = acc.tq.tail(n)
+        with gyr.lock:
+            g = gyr.q.snapshot()
+            g_t = gyr.tq.snapshot()
+
+        if self.q is None:
+            self.reset(a[:, 0])
+            self.last_t = t[0]
+        w = resample(g_t, g, t)
+        dt = np.clip(np.diff(t, prepend=self.last_t) / 1e9, 0, 0.1)
+        self.last_t = t[-1]
+
+        #tilt correction, skipped while the accelerometer sees more than gravity
+        a_mean = a.mean(axis=1)
+        norm = np.sqrt((a_mean ** 2).sum())
+        if abs(norm - 9.81) < 0.2 * 9.81:
+            qw, qx, qy, qz = self.q
+            v = np.array([2 * (qx * qz - qw * qy), 2 * (qy * qz + qw * qx), 1 - 2 * (qx * qx + qy * qy)])
+            e = np.cross(a_mean / norm, v)
+            self.e_int += self.ki * e * dt.sum()
+            w = w + (self.kp * e + self.e_int)[:, None]
+
+        rate = np.sqrt((w ** 2).sum(axis=0))
+        half = rate * dt / 2
+        axis = w / np.where(rate > 0, rate, 1)
+        dq = np.concatenate([np.cos(half)[:, None], (axis * np.sin(half)).T], axis=1)
+        qs = quat_multiply(self.q, quat_cumprod(dq))
+        qs /= np.sqrt((qs ** 2).sum(axis=1))[:, None]
+        self.q = qs[-1]
+
+        values = orientation(remap_x_z(quat_matrix(qs)))
+        #flip pitch direction for graph to follow phone movement
+        values[1] = -values[1]
+        with out.lock:
+            out.q.extend(values)
+            out.tq.extend(t)
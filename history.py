@@ -0,0 +1,184 @@
+import os
+import datetime
+import threading
+import numpy as np
+
+from config import *
+
+
+class History:
+    '''
+    Long range shot history: arrow counts (mirrored from a CountStore) and
+    the per-shot release std of each axis, rolled up per day.
+    Every per-day quantity is kept as a prefix sum over days, so the totals,
+    mean and std histogram of any day range cost two lookups regardless of
+    its length; weeks and months are just ranges. Shots only ever land on
+    the newest day, which makes updates O(1) as well. Loading bins the log
+    per day and takes a single prefix sum (load).
+    The std values are persisted in an append-only log of
+    "<day> <std axis 0> <std axis 1> <std axis 2>" lines.
+    '''
+
+    def __init__(self, path, counts, axes=3, bin_width=HISTORY_STD_BIN, bins=HISTORY_STD_BINS):
+        self.path = path
+        self.axes = axes
+        self.bin_width = bin_width
+        self.bins = bins
+        self.lock = threading.Lock()
+        self.origin = None
+        self.days = 0
+        self.capacity = 0
+        self.alloc(64)
+
+        shots = []
+        tail = '\n'
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    tail = line[-1:]
+                    parts = line.split()
+                    if len(parts) == axes + 1 and len(parts[0]) == 10:
+                        try:
+                            shots.append((datetime.date.fromisoformat(parts[0]), [float(v) for v in parts[1:]]))
+                        except ValueError:
+                            pass #torn write
+        days = [datetime.date.fromisoformat(day) for day in counts.counts] + [day for day, _ in shots]
+        if days:
+            self.extend(min(days))
+            self.extend(max(days))
+            self.load(counts.counts, shots)
+
+        self.counts = counts
+        counts.bind(self.on_count)
+        self.f = open(path, 'a')
+        if tail != '\n':
+            self.f.write('\n')
+
+    def alloc(self, capacity, shift=0):
+        #row i holds the totals of the days before day i, row 0 stays zero
+        old = (self.count, self.n, self.sum, self.hist) if self.capacity else ()
+        self.count = np.zeros(capacity + 1, dtype=np.int64)
+        self.n = np.zeros(capacity + 1, dtype=np.int64)
+        self.sum = np.zeros((capacity + 1, self.axes))
+        self.hist = np.zeros((capacity + 1, self.axes, self.bins), dtype=np.int32)
+        for a, prev in zip((self.count, self.n, self.sum, self.hist), old):
+            a[shift:shift + self.days + 1] = prev[:self.days + 1]
+        self.capacity = capacity
+
+    def extend(self, day):
+        '''make day addressable, returns its index'''
+        if self.origin is None:
+            self.origin = day
+        i = (day - self.origin).days
+        if i < 0:
+            #earlier than anything seen so far, shift everything right
+            self.alloc(2 * (self.days - i), shift=-i)
+            self.days -= i
+            self.origin = day
+            i = 0
+        if i >= self.days:
+            if i + 1 > self.capacity:
+                self.alloc(max(2 * self.capacity, i + 1))
+            for a in (self.count, self.n, self.sum, self.hist):
+                a[self.days + 1:i + 2] = a[self.days]
+            self.days = i + 1
+        return i
+
+    def load(self, counts, shots):
+        #bin everything per day, then one prefix sum, instead of _add per shot
+        d = self.days
+        count = np.zeros(d, dtype=np.int64)
+        n = np.zeros(d, dtype=np.int64)
+        total = np.zeros((d, self.axes))
+        hist = np.zeros((d, self.axes, self.bins), dtype=np.int32)
+        for day, c in counts.items():
+            count[(datetime.date.fromisoformat(day) - self.origin).days] = c
+        if shots:
+            i = np.array([(day - self.origin).days for day, _ in shots])
+            std = np.array([std for _, std in shots], dtype=np.float64)
+            b = np.clip((std / self.bin_width).astype(int), 0, self.bins - 1)
+            np.add.at(n, i, 1)
+            np.add.at(total, i, std)
+            np.add.at(hist, (i[:, None], np.arange(self.axes), b), 1)
+        for a, per_day in zip((self.count, self.n, self.sum, self.hist), (count, n, total, hist)):
+            np.cumsum(per_day, axis=0, out=a[1:d + 1])
+
+    def _add(self, i, count=0, n=0, total=None, hist=None):
+        #prefix sums after day i include it, only the tail past the newest day is touched in the common case
+        end = self.days + 1
+        self.count[i + 1:end] += count
+        if n:
+            self.n[i + 1:end] += n
+            self.sum[i + 1:end] += total
+            self.hist[i + 1:end] += hist
+
+    def _count(self, day, count):
+        i = self.extend(day)
+        have = self.count[i + 1] - self.count[i]
+        self._add(i, count=count - have)
+
+    def _std(self, day, std):
+        i = self.extend(day)
+        std = np.asarray(std, dtype=np.float64)
+        hist = np.zeros((self.axes, self.bins), dtype=np.int32)
+        b = np.clip((std / self.bin_width).astype(int), 0, self.bins - 1)
+        hist[np.arange(self.axes), b] = 1
+        self._add(i, n=1, total=std, hist=hist)
+
+    def on_count(self, day, count):
+        with self.lock:
+            self._count(datetime.date.fromisoformat(day), count)
+
+    def add(self, day, std):
+        '''release std per axis of one accepted shot'''
+        with self.lock:
+            self._std(day, std)
+            self.f.write(f'{day} ' + ' '.join(f'{v:.3f}' for v in std) + '\n')
+            self.f.flush()
+
+    def range(self, start, end):
+        '''totals for start <= day <= end: dict(count, n, mean (axes,), hist (axes, bins))'''
+        with self.lock:
+            if self.origin is None:
+                lo = hi = 0
+            else:
+                lo = min(max((start - self.origin).days, 0), self.days)
+                hi = min(max((end - self.origin).days + 1, 0), self.days)
+                hi = max(hi, lo)
+            n = int(self.n[hi] - self.n[lo])
+            return dict(
+                count=int(self.count[hi] - self.count[lo]),
+                n=n,
+                mean=(self.sum[hi] - self.sum[lo]) / max(n, 1),
+                hist=self.hist[hi] - self.hist[lo],
+            )
+
+    def percentile(self, stats, p):
+        '''per axis std percentile (upper bin edge) from a range() histogram'''
+        cum = np.cumsum(stats['hist'], axis=-1)
+        rank = np.maximum(cum[:, -1] * p / 100, 1)
+        return (np.argmax(cum >= rank[:, None], axis=-1) + 1) * self.bin_width
+
+    def periods(self, period, end, n):
+        '''the last n days, weeks (Monday first) or months up to end, newest first: [(first day, last day), ...]'''
+        out = []
+        if period == 'day':
+            for k in range(n):
+                day = end - datetime.timedelta(days=k)
+                out.append((day, day))
+        elif period == 'week':
+            first = end - datetime.timedelta(days=end.weekday())
+            for k in range(n):
+                start = first - datetime.timedelta(weeks=k)
+                out.append((start, start + datetime.timedelta(days=6)))
+        else:
+            year, month = end.year, end.month
+            for k in range(n):
+                start = datetime.date(year, month, 1)
+                year, month = (year, month + 1) if month < 12 else (year + 1, 1)
+                out.append((start, datetime.date(year, month, 1) - datetime.timedelta(days=1)))
+                year, month = (start.year, start.month - 1) if start.month > 1 else (start.year - 1, 12)
+        return out
+
+    def first_day(self):
+        return self.origin
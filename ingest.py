@@ -0,0 +1,202 @@
+'''
+Ingest server for several phones on one LAN (club or coaching setups).
+Phones with "ingest_url" in smartbow_config.json send their shots here as
+compact binary batches (wire.py) instead of opening their own InfluxDB
+client. The server turns them into the same line protocol the app would
+upload and writes it in large batches over a single pooled connection,
+and/or stores the shot windows in a local archive (archive.py).
+
+    python ingest.py --config smartbow_config.json
+    python ingest.py --archive shots/ --port 8087
+
+POST /shots  binary shot batch (wire.encode_batch)
+POST /write  line protocol passthrough (logs, timings, spooled shots)
+'''
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode
+
+import urllib3
+from urllib3 import Retry
+
+from config import *
+from spool import Spool
+from archive import ShotArchives
+from lineproto import encode_record
+import policy
+from wire import decode_batch
+
+log = logging.getLogger('ingest')
+
+#device ids become archive directory names
+DEVICE_ID = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+
+class Influx:
+    '''InfluxDB v2 write endpoint over one pooled keep-alive connection'''
+
+    def __init__(self, url, org, bucket, token, timeout=10):
+        self.url = url.rstrip('/') + '/api/v2/write?' + urlencode(dict(org=org, bucket=bucket, precision='ns'))
+        self.headers = {
+            'Authorization': f'Token {token}',
+            'Content-Type': 'text/plain; charset=utf-8',
+            'Content-Encoding': 'gzip',
+        }
+        self.http = urllib3.PoolManager(maxsize=1, timeout=timeout, retries=Retry(connect=3, read=2, redirect=3))
+
+    def write(self, data):
+        '''returns the http status'''
+        r = self.http.request('POST', self.url, body=gzip.compress(data), headers=self.headers)
+        return r.status
+
+
+class Ingest:
+    def __init__(self, spool, influx=None, archive_path=None, interval=INGEST_FLUSH_INTERVAL, policies=None):
+        self.spool = spool
+        self.policies = policy.load_policies({}) if policies is None else policies
+        self.influx = influx
+        self.archive_path = archive_path
+        self.archives = {} #id: ShotArchives
+        self.archive_lock = threading.Lock()
+        self.interval = interval
+        self.shots_in = 0
+        self.bytes_out = 0
+
+    def shots(self, body):
+        id, records = decode_batch(body)
+        if not DEVICE_ID.fullmatch(id):
+            raise ValueError(f'ingest: bad device id {id!r}')
+        self.shots_in += sum(cmd == 'acceleration' for cmd, _ in records)
+        if self.archive_path is not None:
+            self.archive(id, records)
+        if self.influx is not None:
+            tags = dict(id=id)
+            self.spool.put(b'\n'.join(self.encode(cmd, val, tags) for cmd, val in records))
+
+    def encode(self, cmd, val, tags):
+        #phones send full windows so the archive keeps them, the upload policy applies to influx only
+        if cmd in self.policies and len(val) == 4:
+            event_time, event_time_buf, points, time = val
+            val = (event_time, event_time_buf) + policy.apply(self.policies[cmd], points, time, event_time_buf)
+        return encode_record(cmd, val, tags)
+
+    def lines(self, body):
+        if self.influx is not None:
+            self.spool.put(body)
+
+    def archive(self, id, records):
+        #a shot is the acceleration and orientation window with the same event time
+        acc = {val[0]: val for cmd, val in records if cmd == 'acceleration'}
+        for cmd, val in records:
+            if cmd != 'orientation' or val[0] not in acc:
+                continue
+            #windows may carry a number format (policy.apply), the archive stores the samples only
+            event_time, peak_t, acc_points, acc_points_t, *_ = acc[val[0]]
+            _, _, points, points_t, *_ = val
+            with self.archive_lock:
+                archive = self.archives.get(id)
+                if archive is None:
+                    archive = self.archives[id] = ShotArchives(os.path.join(self.archive_path, id))
+                archive.append(event_time, peak_t, acc_points, acc_points_t, points, points_t)
+
+    def drain(self):
+        #one large write per spool segment, small ones only after the flush interval
+        backoff = SPOOL_BACKOFF_MIN
+        while True:
+            if self.spool.pending_bytes < self.spool.segment_bytes:
+                time.sleep(self.interval)
+            segment = self.spool.peek()
+            if segment is None:
+                self.spool.wait()
+                continue
+            name, data = segment
+            try:
+                status = self.influx.write(data) if data else 204
+            except urllib3.exceptions.HTTPError as e:
+                log.warning(f'drain: {e}')
+                status = None
+            if status in (400, 422):
+                log.warning(f'drain: dropping {name}: {status}')
+                self.spool.pop(name, dropped=True)
+            elif status is None or status >= 300:
+                self.spool.backoff(backoff)
+                backoff = min(backoff * 2, SPOOL_BACKOFF_MAX)
+            else:
+                self.spool.pop(name)
+                self.bytes_out += len(data)
+                backoff = SPOOL_BACKOFF_MIN
+                log.info(f'drain: {name} {len(data)} bytes, pending: {self.spool.pending_bytes} dropped: {self.spool.dropped_bytes}')
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = 'smartbow-ingest'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            if self.path == '/shots':
+                self.server.ingest.shots(body)
+            elif self.path == '/write':
+                self.server.ingest.lines(body)
+            else:
+                self.send_error(404)
+                return
+        except (ValueError, OSError) as e:
+            self.send_error(400, str(e))
+            return
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        log.debug(f'{self.address_string()} {format % args}')
+
+
+def serve(ingest, host='', port=INGEST_PORT):
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.ingest = ingest
+    if ingest.influx is not None:
+        threading.Thread(target=ingest.drain, daemon=True, name='drain').start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', help='smartbow_config.json with the influx_* settings')
+    parser.add_argument('--archive', help='store shots in a local archive under this directory')
+    parser.add_argument('--spool', default='ingest-spool', help='upload queue directory')
+    parser.add_argument('--host', default='')
+    parser.add_argument('--port', type=int, default=INGEST_PORT)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    influx = None
+    config = {}
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+        influx = Influx(config['influx_url'], config['influx_org'], config['influx_bucket'], config['influx_token'])
+    if influx is None and args.archive is None:
+        parser.error('nothing to do, give --config and/or --archive')
+
+    spool = Spool(args.spool, max_bytes=INGEST_SPOOL_MAX_BYTES, segment_bytes=INGEST_BATCH_BYTES)
+    server = serve(Ingest(spool, influx, args.archive, policies=policy.load_policies(config)), args.host, args.port)
+    log.info(f'ingest: listening on {server.server_address}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
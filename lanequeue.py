@@ -0,0 +1,88 @@
+import threading
+from collections import deque
+from queue import Empty
+
+FLUSH = 'flush'
+
+
+class Lane:
+    __slots__ = ('name', 'cap', 'drop', 'items', 'dropped')
+
+    def __init__(self, name, cap, drop):
+        self.name = name
+        self.cap = cap
+        self.drop = drop #'oldest' evicts the head, 'newest' rejects the incoming item
+        self.items = deque()
+        self.dropped = 0
+
+
+class LaneQueue:
+    '''
+    Bounded priority queue for (cmd, val) messages, a drop-in for the
+    queue.Queue calls the Worker and its producers use.
+    lanes: [(name, cmds, cap, drop), ...] highest priority first. get()
+    always serves the highest priority non-empty lane, so a shot record
+    never waits behind bulk data, and each lane holds at most cap items
+    (no limit with cap None).
+    Commands without a lane go to the last one.
+    'flush' is not queued: it is a marker handed out once every lane
+    except the last (logs) has drained, so one flush covers all the data
+    put before it.
+    '''
+
+    def __init__(self, lanes):
+        self.lanes = [Lane(name, cap, drop) for name, _, cap, drop in lanes]
+        self.route = {cmd: lane for lane, (_, cmds, _, _) in zip(self.lanes, lanes) for cmd in cmds}
+        self.cond = threading.Condition()
+        self.flush = False
+
+    def put(self, item, block=True, timeout=None):
+        cmd = item[0]
+        with self.cond:
+            if cmd == FLUSH:
+                self.flush = True
+            else:
+                lane = self.route.get(cmd, self.lanes[-1])
+                if lane.cap is not None and len(lane.items) >= lane.cap:
+                    lane.dropped += 1
+                    if lane.drop == 'newest':
+                        return
+                    lane.items.popleft()
+                lane.items.append(item)
+            self.cond.notify()
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def _next(self):
+        for lane in self.lanes[:-1]:
+            if lane.items:
+                return lane.items.popleft()
+        if self.flush:
+            self.flush = False
+            return (FLUSH, None)
+        if self.lanes[-1].items:
+            return self.lanes[-1].items.popleft()
+        return None
+
+    def get(self, block=True, timeout=None):
+        with self.cond:
+            item = self._next()
+            if item is None and block:
+                self.cond.wait_for(lambda: self.flush or any(lane.items for lane in self.lanes), timeout)
+                item = self._next()
+            if item is None:
+                raise Empty
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        with self.cond:
+            return sum(len(lane.items) for lane in self.lanes)
+
+    def stats(self):
+        '''{lane: (depth, dropped)}'''
+        with self.cond:
+            return {lane.name: (len(lane.items), lane.dropped) for lane in self.lanes}
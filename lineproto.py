@@ -0,0 +1,54 @@
+import numpy as np
+
+#float32 samples round-trip with 9 significant digits
+FLOAT_FMT = '%.9g'
+
+
+def escape_key(s):
+    return str(s).replace(',', r'\,').replace('=', r'\=').replace(' ', r'\ ')
+
+
+def escape_measurement(s):
+    return str(s).replace(',', r'\,').replace(' ', r'\ ')
+
+
+def series(measurement, tags):
+    return ','.join([escape_measurement(measurement)] + [f'{escape_key(k)}={escape_key(v)}' for k, v in sorted(tags.items())])
+
+
+def encode_window(measurement, tags, points, time, fmt=FLOAT_FMT):
+    '''
+    Encode a (axes, n) sample window into InfluxDB line protocol, one line per
+    axis per sample, tagged with idx=<axis>. Equivalent to building a Point per
+    value, but formatted with a single string operation.
+    '''
+    n_axes, n = points.shape
+    if n == 0:
+        return b''
+    head = series(measurement, tags)
+    sample = ''.join(f'{head},idx={idx} value={fmt} %d\n' for idx in range(n_axes))
+
+    args = np.empty((n, 2 * n_axes), dtype=object)
+    args[:, 0::2] = points.T.astype(np.float64)
+    args[:, 1::2] = np.asarray(time, dtype=np.int64)[:, None]
+    return ((sample * n) % tuple(args.ravel().tolist()))[:-1].encode('utf-8')
+
+
+def encode_fields(measurement, tags, fields, time, fmt=FLOAT_FMT):
+    '''one line per field, same as a Point per field value'''
+    head = series(measurement, tags)
+    return '\n'.join(f'{head} {escape_key(field)}={fmt % value} {int(time)}' for field, value in fields.items()).encode('utf-8')
+
+
+def encode_record(cmd, val, tags):
+    '''
+    Line protocol of one shot record from the Worker queue, shared by the
+    Worker and the ingest server so both upload the same schema. Windows
+    may carry a number format as a fifth element (see policy.apply).
+    '''
+    if cmd in ('event', 'std', 'drift'):
+        time, d = val
+        return encode_fields(cmd, tags, d, time)
+    event_time, event_time_buf, points, time, *fmt = val
+    time = time - event_time_buf + event_time #center around event time, add epoch
+    return encode_window(cmd, tags, points, time, *fmt)
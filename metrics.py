@@ -0,0 +1,76 @@
+import threading
+from time import perf_counter_ns
+
+
+class Stage:
+    '''durations of one pipeline stage, in a log-linear nanosecond histogram (4 buckets per octave)'''
+    __slots__ = ('count', 'total', 'max', 'hist')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.hist = [0] * 256
+
+    def add(self, ns):
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+        b = ns.bit_length()
+        self.hist[ns if b < 3 else (b - 2) * 4 + ((ns >> (b - 3)) & 3)] += 1
+
+    def percentile(self, p):
+        #upper bound of the bucket holding the p-th percentile
+        rank = self.count * p / 100
+        seen = 0
+        for bucket, n in enumerate(self.hist):
+            seen += n
+            if n and seen >= rank:
+                if bucket < 4:
+                    return bucket
+                b = bucket // 4 + 2
+                return min(((5 + bucket % 4) << (b - 3)) - 1, self.max)
+        return self.max
+
+    def summary(self):
+        return dict(
+            count=self.count,
+            mean_us=self.total / self.count / 1e3 if self.count else 0.0,
+            p50_us=self.percentile(50) / 1e3,
+            p99_us=self.percentile(99) / 1e3,
+            max_us=self.max / 1e3,
+        )
+
+
+class Metrics:
+    '''
+    Hot path timing counters. Stages are recorded with
+        t0 = perf_counter_ns()
+        ...
+        metrics.add('stage', perf_counter_ns() - t0)
+    and collected per export interval with snapshot().
+    '''
+
+    def __init__(self):
+        self.stages = {}
+        self.lock = threading.Lock() #add() runs on the pipeline and worker threads
+
+    def add(self, name, ns):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = Stage()
+            stage.add(ns)
+
+    def peek(self):
+        return {name: stage.summary() for name, stage in list(self.stages.items())}
+
+    def snapshot(self):
+        #summaries since the last snapshot, starts a new interval
+        with self.lock:
+            stages, self.stages = self.stages, {}
+        return {name: stage.summary() for name, stage in stages.items()}
+
+
+metrics = Metrics()
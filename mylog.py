@@ -4,8 +4,6 @@ os.environ["KIVY_NO_FILELOG"] = "1"
 from kivy.logger import Logger as log
 from kivy.logger import LogFile
 import logging
-from influxdb_client import Point, WritePrecision, rest
-import urllib3
 class MyLogFile(LogFile):
     def init(self, channel, func):
         self.buffer = ''
@@ -24,21 +22,15 @@ sys.stderr = MyLogFile('stderr', log.error)
 
 
 class QueueLogHandler(logging.StreamHandler):
-    def __init__(self, q, _id=0, write_api=None, bucket=None, org=None):
+    #hands records to the Worker queue, the Worker batches and uploads them
+    def __init__(self, q):
         super().__init__(self)
         self.q = q
-        self.id = _id
-        self.write_api = write_api
-        self.bucket = bucket
-        self.org = org
     def emit(self, record):
-        msg = self.format(record)
-        point = Point('log').tag('id', self.id).time(int(record.created * 1e9), WritePrecision.NS).tag('levelno', record.levelno).field('msg', msg)
-        if self.write_api is not None:
-            try:
-                self.write_api.write(self.bucket, self.org, point)
-            except (rest.ApiException, urllib3.exceptions.MaxRetryError):
-                pass
+        try:
+            msg = self.format(record)
+            self.q.put_nowait(('log', dict(created=record.created, levelno=record.levelno, msg=msg)))
+        except Exception:
+            self.handleError(record)
     def flush(self):
         pass
-
@@ -0,0 +1,171 @@
+import time
+import logging
+import threading
+import numpy as np
+
+from config import *
+from detect import ShotDetector
+from align import locate, resample, release_index
+from running import RunningStd
+import window
+from metrics import metrics, perf_counter_ns
+
+#same logger as kivy.logger.Logger, without importing Kivy
+log = logging.getLogger('kivy')
+
+
+class Pipeline:
+    '''
+    Per-tick processing behind the screens: sensor snapshot, shot detection,
+    acc/ori alignment at the release instant, stability (std) gate and the
+    hand-off to the Worker.
+    Does not depend on Kivy, so it can also be driven headless (bench.py).
+
+    Live, a single pipeline thread runs tick() whenever the sensor listeners
+    signal new samples (sensors.cond), at most once per PIPELINE_INTERVAL.
+    The screens only render the published `latest` result, and `shot`, the
+    result of the last detecting tick, while the graphs are frozen.
+    '''
+    labels =    ['Azimuth', 'Pitch', 'Roll']
+    #each axis has a different resolution
+    resolution_adjust = [8, 2, 2]
+    #multiply by 10x to help visualize with 1 decimal point float
+    std_scale = 10 / np.array(resolution_adjust)
+
+    def __init__(self, sensors, q, on_shot=None):
+        self.sensors = sensors
+        self.q = q
+        self.on_shot = on_shot
+        self.detector = ShotDetector()
+        self.stability = None #RunningStd sized like the orientation ring, see tick
+        self.latest = None #detections, acc_points, points, std
+        self.shot = None #acc_points, points, std of the last detection
+        self.detections = 0
+        self.lock = threading.Lock() #latest, shot and detections change together
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True, name='pipeline')
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stopped.set()
+        with self.sensors.cond:
+            self.sensors.cond.notify_all()
+        self.thread.join(1)
+        self.thread = None
+
+    def run(self):
+        cond = self.sensors.cond
+        while not self.stopped.is_set():
+            with cond:
+                cond.wait(POLL_RATE)
+            t0 = time.monotonic()
+            try:
+                detected, acc_points, points, std = self.tick()
+            except Exception as e:
+                log.warning(f'pipeline: {e}')
+                self.stopped.wait(POLL_RATE)
+                continue
+            with self.lock:
+                if detected:
+                    self.detections += 1
+                    self.shot = (acc_points, points, std)
+                self.latest = (self.detections, acc_points, points, std)
+            #coalesce samples that arrive faster than we need to look at them
+            self.stopped.wait(PIPELINE_INTERVAL - (time.monotonic() - t0))
+
+    def tick(self, this_time_ns=None):
+        '''returns detected, acc_points, points, std'''
+        if this_time_ns is None:
+            this_time_ns = time.time_ns()
+
+        t0 = perf_counter_ns()
+        self.sensors.update()
+        metrics.add('fusion', perf_counter_ns() - t0)
+
+        t0 = perf_counter_ns()
+        snsr = self.sensors.acc
+        with snsr.lock:
+            acc_points  = snsr.q.snapshot()
+            acc_points_t = snsr.tq.snapshot()
+            acc_count = snsr.q.count
+
+        snsr = self.sensors.ori
+        with snsr.lock:
+            points = snsr.q.snapshot()
+            points_t = snsr.tq.snapshot()
+            count = snsr.q.count
+        t1 = perf_counter_ns()
+        metrics.add('snapshot', t1 - t0)
+        np.degrees(points, out=points)
+        if self.stability is None or len(self.stability.t) != len(points_t):
+            #same span as the orientation buffer, so every window the pipeline can ask for is covered
+            self.stability = RunningStd(capacity=len(points_t))
+        self.stability.update(points_t, points, count)
+
+        detected = self.detector.update(this_time_ns, acc_points, acc_count)
+
+        end = points_t[-1]
+        if detected:
+            event_time = self.detector.event_time
+            acc_time = acc_points_t[self.detector.event_time_idx]
+            #last orientation sample before the release, not contaminated by the shot
+            release_time = acc_points_t[release_index(acc_points, self.detector.event_time_idx)] - window.ms(RELEASE_GUARD_MS)
+            event_time_idx = locate(points_t, release_time)
+            hold = resample(points_t, points, [release_time], period=360)[:, 0]
+
+            debug = None
+            if event_time_idx < 1 or self.stability.std(release_time) is None:
+                debug = 'sync failure'
+            elif release_time > points_t[-1]:
+                log.debug(f'detect: orientation lags release by {(release_time - points_t[-1]) / 1e6:.1f}ms')
+            if debug is not None:
+                log.warning(f"detect: '{debug}' ori: idx={event_time_idx}/{len(points_t)-1} buf={points_t[-6:]}\nacc_time: {acc_time} release_time: {release_time} acc_idx={self.detector.event_time_idx}/{len(acc_points_t)-1}")
+                #fall back to a fixed trim from the newest sample
+                event_time_idx = len(points_t) - 1 - RELEASE_TRIM
+                release_time = points_t[event_time_idx]
+                hold = points[:, event_time_idx]
+
+            orig_points = points
+            orig_points_t = points_t
+            points = points[:, :event_time_idx + 1]
+            acc_offset = release_time - acc_time
+            end = release_time
+            value, _ = window.peak(acc_points_t, acc_points, release_time, acc_points_t[-1])
+            drift = window.drift(points_t, orig_points, release_time - window.ms(DRIFT_WINDOW_MS), release_time, period=360)
+        t2 = perf_counter_ns()
+        metrics.add('detect', t2 - t1)
+
+        std = self.stability.std(end)
+        #no full window, nan never passes the STD_MAX gate
+        std = np.full(len(self.std_scale), np.nan) if std is None else std * self.std_scale
+        t3 = perf_counter_ns()
+        metrics.add('std', t3 - t2)
+
+        if detected and (std <= STD_MAX).all():
+            if self.on_shot is not None:
+                self.on_shot()
+            self.q.put(('event', (event_time, dict(value=value))))
+            self.q.put(('acceleration', (event_time, acc_time, acc_points, acc_points_t)))
+            event = {self.labels[i] : v for i, v in enumerate(hold)}
+            self.q.put(('event', (event_time + acc_offset, event)))
+            self.q.put(('orientation', (event_time, acc_time, orig_points, orig_points_t)))
+            self.q.put(('archive', (event_time, acc_time, acc_points, acc_points_t, orig_points, orig_points_t)))
+            event = {self.labels[i] : v for i, v in enumerate(std)}
+            self.q.put(('std', (event_time + acc_offset, event)))
+            event = {self.labels[i] : v for i, v in enumerate(drift)}
+            self.q.put(('drift', (event_time + acc_offset, event)))
+            #how the hold settled: std of the window ending at every orientation sample before the release
+            trace_t, trace = self.stability.stability(release_time - window.ms(STABILITY_TRACE_MS), release_time)
+            self.q.put(('stability', (event_time, acc_time, trace * self.std_scale[:, None], trace_t)))
+            self.q.put(('flush', None))
+            metrics.add('handoff', perf_counter_ns() - t3)
+
+        return detected, acc_points, points, std
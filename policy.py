@@ -0,0 +1,45 @@
+import numpy as np
+
+import window
+from lineproto import FLOAT_FMT
+from config import *
+
+
+def load_policies(config):
+    '''
+    UPLOAD_POLICY with the per stream overrides from the "upload_policy"
+    entry of smartbow_config.json, e.g.
+        "upload_policy": {"acceleration": {"before_ms": 200, "decimals": 1}}
+    '''
+    policies = {stream: dict(policy) for stream, policy in UPLOAD_POLICY.items()}
+    for stream, policy in config.get('upload_policy', {}).items():
+        policies.setdefault(stream, {}).update(policy)
+    return policies
+
+
+def apply(policy, points, t, center):
+    '''
+    Trim a (axes, n) window to before_ms/after_ms around center (sensor
+    clock ns), keep every sample within core_ms of it and every decimate-th
+    one outside, and round to decimals places. Returns points, t and the
+    line protocol number format.
+    '''
+    if 'before_ms' in policy or 'after_ms' in policy:
+        start = center - window.ms(policy['before_ms']) if 'before_ms' in policy else t[0] - 1
+        end = center + window.ms(policy['after_ms']) if 'after_ms' in policy else t[-1]
+        s = window.span(t, start, end)
+        points = points[:, s]
+        t = t[s]
+
+    step = int(policy.get('decimate', 1))
+    if step > 1:
+        keep = np.abs(t - center) <= window.ms(policy.get('core_ms', 0))
+        #phase the outer samples on the center so the grid is the same left and right
+        keep |= (np.arange(len(t)) - np.searchsorted(t, center)) % step == 0
+        points = points[:, keep]
+        t = t[keep]
+
+    decimals = policy.get('decimals')
+    if decimals is None:
+        return points, t, FLOAT_FMT
+    return np.round(points.astype(np.float64), decimals), t, f'%.{decimals}f'
@@ -0,0 +1,187 @@
+'''
+Offline shot re-detection over recorded sessions (see session.py).
+
+    python redetect.py session.bin [session2.bin ...] --shots shots.csv
+    python redetect.py session.bin --thresh 40 --freeze 3
+
+Reproduces what the live pipeline (pipeline.Pipeline with detect.ShotDetector)
+would have reported for the recording, as whole session array operations:
+per-tick maxima of the acceleration stream, the refractory period after each
+detection, release alignment, the hold std window and the STD_MAX gate. Ticks
+are PIPELINE_INTERVAL apart on the sensor clock, every tick sees the last
+ACCELEROMETER_BUFFER_LEN / --ori-len samples like the live ring buffers.
+'''
+import sys
+import csv
+import argparse
+import numpy as np
+
+from config import *
+from session import read_session
+from align import release_indices, resample
+from pipeline import Pipeline
+import window
+
+FIELDS = (['time', 'peak_time', 'release_time', 'value', 'accepted', 'synced']
+    + [f'hold_{label}' for label in Pipeline.labels]
+    + [f'std_{label}' for label in Pipeline.labels]
+    + [f'drift_{label}' for label in Pipeline.labels])
+
+
+def ticks(t, interval):
+    '''
+    detection ticks, interval seconds apart on the sensor clock from the first
+    sample: tick time and the end (exclusive sample index) of what it sees
+    '''
+    step = int(interval * 1e9)
+    grid = np.arange(t[0], t[-1] + step, step)
+    return grid, np.searchsorted(t, grid, 'right')
+
+
+def range_max(values, lo, hi):
+    #max of values[lo:hi] for every (lo, hi) pair, 0 for empty ranges
+    idx = np.empty(2 * len(lo), dtype=np.int64)
+    idx[0::2] = lo
+    idx[1::2] = hi
+    m = np.maximum.reduceat(np.append(values, 0), idx)[0::2] if len(lo) else np.zeros(0)
+    return np.where(hi > lo, m, 0)
+
+
+def detect(t, acc, thresh=EVENT_THRESH, freeze=GRAPH_FREEZE, interval=PIPELINE_INTERVAL, buffer_len=ACCELEROMETER_BUFFER_LEN):
+    '''
+    ShotDetector over a whole (axes, n) acceleration stream.
+    returns tick time, tick end (exclusive sample index) and peak sample index per detection
+    '''
+    mag = np.abs(acc).max(axis=0)
+    grid, ends = ticks(t, interval)
+    starts = np.r_[0, ends[:-1]]
+    #only ticks with a new sample above the threshold can detect, besides the first one after a freeze
+    candidates = np.flatnonzero(range_max(mag, starts, ends) > thresh)
+    freeze_ns = freeze * 1e9
+
+    found = []
+    k = candidates[0] if len(candidates) else len(ends)
+    cursor = starts[k] if k < len(ends) else 0
+    while k < len(ends):
+        #samples since the last unfrozen tick, as far back as the buffer reaches
+        s = max(cursor, ends[k] - buffer_len)
+        if ends[k] > s and mag[s:ends[k]].max() > thresh:
+            found.append((grid[k], ends[k], s + int(np.argmax(mag[s:ends[k]]))))
+            cursor = ends[k]
+            k = int(np.searchsorted(grid, grid[k] + freeze_ns, 'right'))
+            continue
+        j = int(np.searchsorted(candidates, k + 1))
+        if j == len(candidates):
+            break
+        k = candidates[j]
+        cursor = starts[k]
+    found = np.array(found, dtype=np.int64).reshape(-1, 3)
+    return found[:, 0], found[:, 1], found[:, 2]
+
+
+def window_sums(values, lo, hi):
+    #per axis sum and sum of squares of values[:, lo:hi] for every (lo, hi) pair, from prefix sums
+    d = values.astype(np.float64) - values[:, :1]
+    p1 = np.concatenate([np.zeros((len(d), 1)), np.cumsum(d, axis=1)], axis=1)
+    p2 = np.concatenate([np.zeros((len(d), 1)), np.cumsum(d * d, axis=1)], axis=1)
+    return p1[:, hi] - p1[:, lo], p2[:, hi] - p2[:, lo]
+
+
+def redetect(acc_t, acc, ori_t, ori, ori_len=ORIENTATION_BUFFER_LEN, **kwargs):
+    '''
+    acc_t (n,), acc (3, n), ori_t (m,), ori (3, m) radians of one session,
+    ori_len: orientation buffer length of the recording app (FUSED_BUFFER_LEN with GYRO_FUSION)
+    returns {field: (shots,) array}, see FIELDS
+    '''
+    time, ends, peaks = detect(acc_t, acc, **kwargs)
+    s = len(ends)
+    ori = np.degrees(ori)
+    acc_len = kwargs.get('buffer_len', ACCELEROMETER_BUFFER_LEN)
+
+    #the acceleration ring buffer at each detection, zeros before the first sample like the live one
+    pad_acc = np.concatenate([np.zeros((3, acc_len), dtype=acc.dtype), acc], axis=1)
+    pad_t = np.concatenate([np.zeros(acc_len, dtype=acc_t.dtype), acc_t])
+    cols = ends[:, None] + np.arange(acc_len)
+    points = pad_acc[:, cols].transpose(1, 0, 2)
+    points_t = pad_t[cols]
+    rows = np.arange(s)
+    release = points_t[rows, release_indices(points, peaks - ends + acc_len)] - window.ms(RELEASE_GUARD_MS)
+
+    #the orientation ring buffer at each detection ends with the newest sample at that time
+    ori_end = np.searchsorted(ori_t, time, 'right')
+    ori_start = np.maximum(ori_end - ori_len, 0)
+
+    def covered(end):
+        #the std window ending at end lies in the buffer with at least 2 samples, as RunningStd.std checks
+        last = np.minimum(np.searchsorted(ori_t, end, 'right'), ori_end) - 1
+        first = np.searchsorted(ori_t, end - window.ms(STD_WINDOW_MS), 'right')
+        return ((ori_end < ori_len) | (first > ori_start)) & (last >= ori_start) & (last - first >= 1)
+
+    synced = (np.searchsorted(ori_t, release, 'right') - 1 - ori_start >= 1) & (ori_end > 0) & covered(release)
+    fallback = np.clip(ori_end - 1 - RELEASE_TRIM, 0, len(ori_t) - 1)
+    release = np.where(synced, release, ori_t[fallback])
+    #interpolation clamps at the newest sample of the buffer when the orientation lags
+    newest = ori_t[np.maximum(ori_end - 1, 0)]
+    hold = resample(ori_t, ori, np.minimum(release, newest), period=360)
+    hold = np.where(synced, hold, ori[:, fallback])
+
+    def span(start):
+        lo = np.maximum(np.searchsorted(ori_t, start, 'right'), ori_start)
+        hi = np.minimum(np.searchsorted(ori_t, release, 'right'), ori_end)
+        return lo, np.maximum(hi, lo)
+
+    lo, hi = span(release - window.ms(STD_WINDOW_MS))
+    n = hi - lo
+    s1, s2 = window_sums(ori, lo, hi)
+    mean = s1 / np.maximum(n, 1)
+    std = np.sqrt(np.maximum(s2 / np.maximum(n, 1) - mean * mean, 0))
+    #no full window, nan never passes the STD_MAX gate
+    std = np.where(covered(release), std, np.nan) * Pipeline.std_scale[:, None]
+
+    lo, hi = span(release - window.ms(DRIFT_WINDOW_MS))
+    drift = ori[:, np.maximum(hi - 1, 0)] - ori[:, np.minimum(lo, len(ori_t) - 1)]
+    drift = np.where(hi - lo >= 2, (drift + 180) % 360 - 180, 0)
+
+    #peak acceleration after the release, up to the newest sample of the tick
+    value = range_max(np.abs(acc).max(axis=0), np.searchsorted(acc_t, release, 'right'), ends)
+
+    out = dict(time=time, peak_time=acc_t[peaks], release_time=release, value=value,
+        accepted=(std <= STD_MAX).all(axis=0), synced=synced)
+    for i, label in enumerate(Pipeline.labels):
+        out[f'hold_{label}'] = hold[i]
+        out[f'std_{label}'] = std[i]
+        out[f'drift_{label}'] = drift[i]
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sessions', nargs='+', help='session files recorded with RECORD_SESSION')
+    parser.add_argument('--thresh', type=float, default=EVENT_THRESH)
+    parser.add_argument('--freeze', type=float, default=GRAPH_FREEZE)
+    parser.add_argument('--ori-len', type=int, default=FUSED_BUFFER_LEN if GYRO_FUSION else ORIENTATION_BUFFER_LEN,
+                        help='orientation buffer length of the recording app')
+    parser.add_argument('--all', action='store_true', help='also list detections rejected by the STD_MAX gate')
+    parser.add_argument('--shots', help='write the shots to this csv')
+    args = parser.parse_args(argv)
+
+    rows = []
+    for name in args.sessions:
+        streams = read_session(name)
+        if 'acc' not in streams or 'ori' not in streams:
+            print(f'{name}: needs acc and ori streams, has {", ".join(streams)}', file=sys.stderr)
+            continue
+        shots = redetect(*streams['acc'], *streams['ori'], thresh=args.thresh, freeze=args.freeze, ori_len=args.ori_len)
+        keep = np.ones(len(shots['time']), dtype=bool) if args.all else shots['accepted']
+        print(f"{name}: {len(shots['time'])} detections, {int(shots['accepted'].sum())} shots")
+        rows += [[name] + list(r) for r in zip(*(shots[field][keep] for field in FIELDS))]
+
+    if args.shots:
+        with open(args.shots, 'w', newline='') as f:
+            w = csv.writer(f)
+            w.writerow(['session'] + FIELDS)
+            w.writerows(rows)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+import numpy as np
+
+
+class RingBuffer:
+    '''
+    Fixed capacity sample buffer with a write cursor.
+    Every sample is written twice (at pos and pos + capacity), so the last
+    `capacity` samples are always available as one contiguous, time-ordered
+    slice without any reordering or reallocation.
+    '''
+
+    def __init__(self, capacity, width=None, dtype=np.float32):
+        self.capacity = capacity
+        self.width = width
+        shape = (2 * capacity,) if width is None else (width, 2 * capacity)
+        self.buf = np.zeros(shape, dtype=dtype)
+        self.pos = 0    #index of the oldest sample
+        self.count = 0  #total samples ever written, usable as a read cursor
+
+    def __len__(self):
+        return self.capacity
+
+    def append(self, value):
+        i = self.pos
+        self.buf[..., i] = value
+        self.buf[..., i + self.capacity] = value
+        i += 1
+        self.pos = 0 if i == self.capacity else i
+        self.count += 1
+
+    def extend(self, values):
+        #values: (width, n) or (n,) block, oldest sample first
+        n = values.shape[-1]
+        self.count += n
+        if n > self.capacity:
+            values = values[..., -self.capacity:]
+            n = self.capacity
+        i = self.pos
+        c = self.capacity
+        k = min(n, c - i) #up to the wrap
+        self.buf[..., i:i + k] = values[..., :k]
+        self.buf[..., i + c:i + c + k] = values[..., :k]
+        if k < n:
+            self.buf[..., :n - k] = values[..., k:]
+            self.buf[..., c:c + n - k] = values[..., k:]
+        self.pos = (i + n) % c
+
+    def view(self):
+        #zero-copy, only valid while the writer is locked out
+        return self.buf[..., self.pos:self.pos + self.capacity]
+
+    def snapshot(self):
+        #single contiguous copy, safe to use after the lock is released
+        return self.view().copy()
+
+    def tail(self, n):
+        n = min(n, self.capacity)
+        end = self.pos + self.capacity
+        return self.buf[..., end - n:end].copy()
@@ -0,0 +1,101 @@
+import numpy as np
+
+from config import *
+from ring import RingBuffer
+import window
+
+
+class RunningStd:
+    '''
+    Sliding window standard deviation of a sample stream, per axis.
+    Samples are fed once, by read cursor (RingBuffer.count), and added to
+    running prefix sums of the values and their squares. The sums over any
+    window are then the difference of two prefix entries, so leaving samples
+    are removed exactly and the std of the window ending at any retained
+    sample costs two lookups. Windows are start < t <= end like window.std.
+
+    The same lookups give the std of the window ending at every retained
+    sample, a stability trace at sensor rate (stability()).
+    '''
+
+    #prefix sums are rebased before they get large enough to cost precision
+    rebase_limit = 1e9
+
+    def __init__(self, capacity=ORIENTATION_BUFFER_LEN, axes=3, window_ms=STD_WINDOW_MS):
+        self.axes = axes
+        self.window_ns = window.ms(window_ms)
+        self.t = RingBuffer(capacity, dtype=np.int64)
+        self.p = RingBuffer(capacity, 2 * axes, dtype=np.float64) #prefix sums of the values, then of their squares
+        self.s = np.zeros(2 * axes) #prefix sums up to the newest sample
+        self.shift = None #values are summed relative to the first sample
+        self.cursor = 0
+
+    def update(self, t, values, count):
+        '''
+        t, values: (n,) / (axes, n) snapshot of the stream, newest sample last
+        count: total samples written to the stream when the snapshot was taken
+        '''
+        new = min(count - self.cursor, len(t), len(self.t))
+        self.cursor = count
+        if new > 0:
+            self.extend(t[-new:], values[:, -new:])
+
+    def extend(self, t, values):
+        a = self.axes
+        if self.shift is None:
+            self.shift = values[:, :1].astype(np.float64)
+        p = np.empty((2 * a, len(t)))
+        np.subtract(values, self.shift, out=p[:a])
+        np.multiply(p[:a], p[:a], out=p[a:])
+        np.cumsum(p, axis=1, out=p)
+        p += self.s[:, None]
+        self.s = p[:, -1]
+        self.t.extend(t)
+        self.p.extend(p)
+        if self.s[a:].max() > self.rebase_limit:
+            self.p.buf -= self.s[:, None]
+            self.s = np.zeros(2 * a)
+
+    def filled(self):
+        return min(self.t.count, len(self.t))
+
+    def std(self, end=None):
+        '''
+        per axis std of the window ending at time end (the newest sample by
+        default), None when the window is not fully in the ring or holds
+        fewer than 2 samples
+        '''
+        t = self.t.view()
+        c = len(t)
+        if end is None:
+            i = c - 1
+            end = t[i]
+        else:
+            i = int(t.searchsorted(end, 'right')) - 1
+        #the entry before the window start, unfilled slots stand for the time before the first sample
+        start = int(t.searchsorted(end - self.window_ns, 'right')) - 1
+        n = i - start
+        if start < 0 or i < c - self.filled() or n < 2:
+            return None
+        p = self.p.view()
+        d = (p[:, i] - p[:, start]) / n
+        a = self.axes
+        return np.sqrt(np.maximum(d[a:] - d[:a] * d[:a], 0))
+
+    def stability(self, start, end):
+        '''
+        std trace for the samples with start < t <= end whose window is fully
+        in the ring: t (k,), std (axes, k) of the window ending at each
+        '''
+        c = len(self.t)
+        t = self.t.view()
+        s = window.span(t[c - self.filled():], start, end)
+        i = np.arange(s.start, s.stop) + c - self.filled()
+        first = t.searchsorted(t[i] - self.window_ns, 'right') - 1
+        n = i - first
+        keep = (first >= 0) & (n >= 2)
+        i, first, n = i[keep], first[keep], n[keep]
+        p = self.p.view()
+        d = (p[:, i] - p[:, first]) / n
+        a = self.axes
+        return t[i], np.sqrt(np.maximum(d[a:] - d[:a] * d[:a], 0))
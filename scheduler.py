@@ -0,0 +1,61 @@
+import math
+import time
+
+from config import *
+
+
+class Scheduler:
+    '''
+    Adaptive screen refresh. Screens report what each frame cost and whether
+    it drew; next() returns the delay until the following frame and keeps
+    draw_every, the number of frames per redraw, so that the UI stays within
+    FRAME_BUDGET of one core:
+
+        (poll + draw / draw_every) / interval <= FRAME_BUDGET
+
+    The interval is never shorter than it takes the sensor to deliver
+    POLL_MIN_SAMPLES new samples, screens without a stream poll slowly. boost() drops to the shortest interval for
+    SCHED_BOOST seconds so a detected shot shows up without waiting.
+    '''
+
+    def __init__(self, budget=FRAME_BUDGET, fast=POLL_RATE_MIN, slow=POLL_RATE_MAX, alpha=0.2):
+        self.budget = budget
+        self.fast = fast
+        self.slow = slow
+        self.alpha = alpha
+        self.poll = 0.0 #smoothed seconds per frame without a redraw
+        self.draw = 0.0 #smoothed extra seconds of a redraw
+        self.interval = POLL_RATE
+        self.draw_every = GRAPH_DRAW_EVERY_FRAMES
+        self.boost_until = 0.0
+
+    def boost(self, duration=SCHED_BOOST):
+        self.boost_until = time.monotonic() + duration
+
+    def record(self, seconds, drew):
+        a = self.alpha
+        if drew:
+            self.draw += a * (max(seconds - self.poll, 0.0) - self.draw)
+        else:
+            self.poll += a * (seconds - self.poll)
+
+    def next(self, rate):
+        '''delay before the next frame, rate: samples/sec of the stream on screen, None if nothing streams'''
+        if time.monotonic() < self.boost_until:
+            self.interval = self.fast
+            self.draw_every = 1
+            return self.interval
+        fast = min(max(self.fast, POLL_MIN_SAMPLES / rate), self.slow) if rate else self.slow
+
+        frame = self.poll + self.draw
+        interval = frame / self.budget
+        if interval <= self.slow:
+            self.draw_every = 1
+            self.interval = min(max(interval, fast), self.slow)
+        else:
+            #redraw every few frames at the slowest pace
+            spare = self.budget * self.slow - self.poll
+            self.draw_every = math.ceil(self.draw / spare) if spare > 0 else GRAPH_DRAW_MAX_EVERY
+            self.draw_every = min(max(self.draw_every, 1), GRAPH_DRAW_MAX_EVERY)
+            self.interval = self.slow
+        return self.interval
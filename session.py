@@ -0,0 +1,79 @@
+import struct
+import threading
+import numpy as np
+
+MAGIC = b'SBSESS1\n'
+#chunk: stream name, sample count, sample width, then int64 timestamps and float32 samples
+CHUNK = struct.Struct('<4sII')
+
+
+class SessionRecorder:
+    '''
+    Streams every raw sample of a set of sensor sources into a session file.
+    Sources are polled from a background thread using the ring buffer sample
+    count as a read cursor, so the sensor callbacks do no extra work. The poll
+    interval has to be shorter than the time it takes to fill a ring buffer.
+    '''
+
+    def __init__(self, path, streams, interval=0.2):
+        self.path = path
+        self.streams = streams
+        self.interval = interval
+        self.cursors = {name: snsr.q.count for name, snsr in streams.items()}
+        self.lost = 0
+        self.stopped = threading.Event()
+        self.f = open(path, 'wb')
+        self.f.write(MAGIC)
+
+    def start(self):
+        th = threading.Thread(target=self.do, daemon=True, name='recorder')
+        th.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def poll(self):
+        for name, snsr in self.streams.items():
+            with snsr.lock:
+                new = snsr.q.count - self.cursors[name]
+                self.cursors[name] = snsr.q.count
+                n = min(new, snsr.q.capacity)
+                if n <= 0:
+                    continue
+                t = snsr.tq.tail(n)
+                values = snsr.q.tail(n)
+            self.lost += new - n
+            values = np.ascontiguousarray(values.T, dtype=np.float32)
+            self.f.write(CHUNK.pack(name.encode('ascii'), n, values.shape[1]))
+            self.f.write(t.astype('<i8').tobytes())
+            self.f.write(values.tobytes())
+
+    def do(self):
+        while not self.stopped.wait(self.interval):
+            self.poll()
+        self.poll()
+        self.f.close()
+
+
+def read_session(path):
+    '''returns {name: (timestamps (n,), samples (width, n))}'''
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if not raw.startswith(MAGIC):
+        raise ValueError(f'{path}: not a session file')
+
+    chunks = {}
+    pos = len(MAGIC)
+    while pos + CHUNK.size <= len(raw):
+        name, n, width = CHUNK.unpack_from(raw, pos)
+        pos += CHUNK.size
+        size = n * 8 + n * width * 4
+        if pos + size > len(raw):
+            break #recording was cut short
+        t = np.frombuffer(raw, dtype='<i8', count=n, offset=pos)
+        values = np.frombuffer(raw, dtype='<f4', count=n * width, offset=pos + n * 8).reshape(n, width)
+        chunks.setdefault(name.rstrip(b'\0').decode('ascii'), []).append((t, values))
+        pos += size
+
+    return {name: (np.concatenate([t for t, _ in c]), np.concatenate([v for _, v in c]).T.copy())
+            for name, c in chunks.items()}
@@ -0,0 +1,130 @@
+import os
+import struct
+import threading
+import zlib
+
+from config import *
+
+#record: payload length, crc32 of payload, payload
+HEADER = struct.Struct('<II')
+
+
+class Spool:
+    '''
+    Append-only on-disk upload queue.
+    Payloads are appended to numbered segment files as length and crc framed
+    records and fsynced, so a crash can at most lose the record being written.
+    Segments are uploaded oldest first and deleted once acknowledged. When the
+    spool grows beyond max_bytes the oldest segments are dropped.
+    '''
+
+    def __init__(self, path, max_bytes=SPOOL_MAX_BYTES, segment_bytes=SPOOL_SEGMENT_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        self.event = threading.Event() #data was put, wakes an idle drainer
+        self.resumed = threading.Event() #uploads work again, ends a backoff early
+        os.makedirs(path, exist_ok=True)
+
+        self.segments = [] #[name, size], oldest first
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.seg'):
+                self.segments.append([name, os.path.getsize(os.path.join(path, name))])
+        self.seq = int(self.segments[-1][0][:-4]) + 1 if self.segments else 0
+        self.pending_bytes = sum(size for _, size in self.segments)
+        self.dropped_bytes = 0
+        self.f = None #active segment, always the last one in self.segments
+        self.reading = None #segment handed out by peek and not popped yet
+        if self.segments:
+            self.event.set()
+
+    def _open(self):
+        name = f'{self.seq:08d}.seg'
+        self.seq += 1
+        self.f = open(os.path.join(self.path, name), 'ab')
+        self.segments.append([name, 0])
+
+    def _seal(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def _remove(self, i):
+        name, size = self.segments.pop(i)
+        try:
+            os.remove(os.path.join(self.path, name))
+        except FileNotFoundError:
+            pass
+        self.pending_bytes -= size
+        return size
+
+    def put(self, data):
+        rec = HEADER.pack(len(data), zlib.crc32(data)) + data
+        with self.lock:
+            if self.f is None or self.segments[-1][1] >= self.segment_bytes:
+                self._seal()
+                self._open()
+            self.f.write(rec)
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self.segments[-1][1] += len(rec)
+            self.pending_bytes += len(rec)
+
+            #bounded disk usage, drop oldest first but never the active segment or the one being uploaded
+            while self.pending_bytes > self.max_bytes:
+                i = next((i for i, (name, _) in enumerate(self.segments[:-1]) if name != self.reading), None)
+                if i is None:
+                    break
+                self.dropped_bytes += self._remove(i)
+        self.event.set()
+
+    def peek(self):
+        '''returns (name, payload) of the oldest segment, or None if empty'''
+        with self.lock:
+            if not self.segments:
+                return None
+            name = self.segments[0][0]
+            self.reading = name
+            if len(self.segments) == 1:
+                self._seal()
+            with open(os.path.join(self.path, name), 'rb') as f:
+                raw = f.read()
+
+        records = []
+        pos = 0
+        while pos + HEADER.size <= len(raw):
+            size, crc = HEADER.unpack_from(raw, pos)
+            data = raw[pos + HEADER.size: pos + HEADER.size + size]
+            if len(data) != size or zlib.crc32(data) != crc:
+                break #torn write
+            records.append(data)
+            pos += HEADER.size + size
+        return name, b'\n'.join(records)
+
+    def pop(self, name, dropped=False):
+        with self.lock:
+            if name == self.reading:
+                self.reading = None
+            for i, (n, _) in enumerate(self.segments):
+                if n == name:
+                    if self.f is not None and i == len(self.segments) - 1:
+                        self._seal()
+                    size = self._remove(i)
+                    if dropped:
+                        self.dropped_bytes += size
+                    break
+
+    def wait(self, timeout=None):
+        '''idle drainer: until data is put'''
+        self.event.wait(timeout)
+        self.event.clear()
+
+    def backoff(self, timeout):
+        '''drainer after a failed upload: until timeout or resume(), new data does not end it'''
+        self.resumed.wait(timeout)
+        self.resumed.clear()
+
+    def resume(self):
+        self.resumed.set()
+        self.event.set()
@@ -0,0 +1,28 @@
+'''
+Cold start timeline. main.py imports this first and marks the end of each
+start-up step; bench_startup.py reads the report.
+'''
+import os
+import time
+
+#process start, as close as Python lets us get
+T0 = time.perf_counter()
+marks = [] #(name, seconds since T0)
+
+
+def mark(name):
+    marks.append((name, time.perf_counter() - T0))
+
+
+def report():
+    '''one line per step: name, ms since start, ms for the step'''
+    lines = []
+    last = 0.0
+    for name, t in marks:
+        lines.append(f'startup: {name:16} {t * 1e3:8.1f} {(t - last) * 1e3:8.1f}')
+        last = t
+    return '\n'.join(lines)
+
+
+#set by bench_startup.py: print the report and quit after the first frame
+BENCH = bool(os.environ.get('SMARTBOW_STARTUP_BENCH'))
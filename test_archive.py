@@ -0,0 +1,46 @@
+'''
+archive.py record layouts.
+
+    python -m unittest test_archive
+'''
+import os
+import tempfile
+import unittest
+import numpy as np
+
+from config import *
+from archive import ShotArchives, open_archives
+
+
+def windows(event_time, ori_len):
+    acc_t = np.arange(ACCELEROMETER_BUFFER_LEN, dtype=np.int64) * 2_000_000
+    ori_t = np.arange(ori_len, dtype=np.int64) * 2_000_000
+    acc = np.ones((3, ACCELEROMETER_BUFFER_LEN), dtype=np.float32)
+    ori = np.tile(np.arange(ori_len, dtype=np.float32), (3, 1))
+    return event_time, acc_t[300], acc, acc_t, ori, ori_t
+
+
+class ShotArchivesTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_fused_orientation(self):
+        #GYRO_FUSION orientation windows are FUSED_BUFFER_LEN long
+        archives = ShotArchives(self.dir.name)
+        archives.append(*windows(10**18, FUSED_BUFFER_LEN))
+        archives.append(*windows(10**18 + 1, FUSED_BUFFER_LEN))
+        archives.append(*windows(10**18 + 2, ORIENTATION_BUFFER_LEN))
+
+        layouts = {(a.dtype['acc'].shape[1], a.dtype['ori'].shape[1]): a for a in open_archives(self.dir.name)}
+        self.assertEqual(sorted(layouts), sorted([(ACCELEROMETER_BUFFER_LEN, FUSED_BUFFER_LEN), (ACCELEROMETER_BUFFER_LEN, ORIENTATION_BUFFER_LEN)]))
+        shots = layouts[ACCELEROMETER_BUFFER_LEN, FUSED_BUFFER_LEN].load()
+        self.assertEqual(list(shots['time']), [10**18, 10**18 + 1])
+        np.testing.assert_array_equal(shots['ori'][0, 1], np.arange(FUSED_BUFFER_LEN))
+        self.assertEqual(len(layouts[ACCELEROMETER_BUFFER_LEN, ORIENTATION_BUFFER_LEN]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+'''
+ingest.py against a local stand-in for the InfluxDB write endpoint.
+
+    python -m unittest test_ingest
+'''
+import os
+import gzip
+import queue
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+from ingest import Ingest, Influx, serve
+from spool import Spool
+from wire import encode_batch
+
+
+class FakeInflux(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.writes.put((self.path, gzip.decompress(body)))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def shot(event_time):
+    t = np.arange(400, dtype=np.int64) * 2_000_000
+    ori_t = np.arange(200, dtype=np.int64) * 10_000_000
+    acc = np.zeros((3, 400), dtype=np.float32)
+    return [
+        ('event', (event_time, dict(value=50.0))),
+        ('acceleration', (event_time, t[300], acc, t)),
+        ('orientation', (event_time, t[300], np.ones((3, 200), dtype=np.float32), ori_t)),
+        ('std', (event_time, dict(Azimuth=1.5, Pitch=2.0, Roll=0.5))),
+    ]
+
+
+class IngestTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.influx = ThreadingHTTPServer(('127.0.0.1', 0), FakeInflux)
+        self.influx.writes = queue.Queue()
+        influx = Influx(start(self.influx), 'org', 'bucket', 'token')
+        self.archive = os.path.join(self.dir.name, 'archive')
+        ingest = Ingest(Spool(os.path.join(self.dir.name, 'spool')), influx, self.archive, interval=0.05)
+        self.server = serve(ingest, '127.0.0.1', 0)
+        self.url = start(self.server)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.influx.shutdown()
+        self.server.server_close()
+        self.influx.server_close()
+        self.dir.cleanup()
+
+    def post(self, body):
+        r = urllib.request.urlopen(urllib.request.Request(self.url + '/shots', data=body, method='POST'), timeout=5)
+        return r.status
+
+    def test_shots_to_line_protocol(self):
+        self.assertEqual(self.post(encode_batch('phone1', shot(10**18))), 204)
+        path, data = self.influx.writes.get(timeout=5)
+        self.assertTrue(path.startswith('/api/v2/write?'))
+        lines = data.split(b'\n')
+        self.assertIn(b'event,id=phone1 value=50 1000000000000000000', lines)
+        self.assertIn(b'std,id=phone1 Pitch=2 1000000000000000000', lines)
+        acc = [l for l in lines if l.startswith(b'acceleration,id=phone1,idx=0 ')]
+        #UPLOAD_POLICY trims and thins the window before the write
+        self.assertTrue(0 < len(acc) < 400)
+        self.assertTrue(all(l.startswith(b'orientation,id=phone1,idx=') for l in lines if l.startswith(b'orientation')))
+        #the archive keeps the full windows
+        self.assertEqual(sorted(os.listdir(os.path.join(self.archive, 'phone1'))), ['shots-400x200.bin', 'shots-400x200.idx'])
+
+    def test_bad_device_id(self):
+        for id in ('../../x', '/tmp/x', ''):
+            with self.assertRaises(urllib.error.HTTPError) as e:
+                self.post(encode_batch(id, shot(10**18)))
+            self.assertEqual(e.exception.code, 400)
+        self.assertFalse(os.path.exists(self.archive))
+        self.assertTrue(self.influx.writes.empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
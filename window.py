@@ -0,0 +1,74 @@
+import numpy as np
+
+
+def ms(n):
+    '''milliseconds to nanoseconds, the unit of the sensor timestamps'''
+    return int(n * 1e6)
+
+
+def span(t, start, end):
+    '''
+    slice of the samples with start < t <= end. Windows are picked by
+    timestamp, so they stay exact when the sensor jitters or drops samples.
+    '''
+    return slice(int(np.searchsorted(t, start, 'right')), int(np.searchsorted(t, end, 'right')))
+
+
+def std(t, values, start, end):
+    '''per axis standard deviation of (axes, n) values over the window, 0 with fewer than 2 samples'''
+    w = values[:, span(t, start, end)]
+    if w.shape[1] < 2:
+        return np.zeros(values.shape[0])
+    return np.std(w, axis=-1)
+
+
+def peak(t, values, start, end):
+    '''largest absolute sample over all axes in the window and its index, (0, -1) if empty'''
+    s = span(t, start, end)
+    w = np.abs(values[:, s])
+    if w.shape[1] == 0:
+        return 0, -1
+    i = int(np.argmax(w.max(axis=0)))
+    return w[:, i].max(), s.start + i
+
+
+def drift(t, values, start, end, period=None):
+    '''per axis change from the first to the last sample of the window, the short way round with a period'''
+    s = span(t, start, end)
+    if s.stop - s.start < 2:
+        return np.zeros(values.shape[0])
+    delta = values[:, s.stop - 1] - values[:, s.start]
+    if period is not None:
+        delta = (delta + period / 2) % period - period / 2
+    return delta
+
+
+#the same windows for a batch of shots: (shots, n) timestamps, (shots, axes, n) values, one start/end per shot
+
+def inside(t, start, end):
+    '''(shots, n) mask of start < t <= end'''
+    return (t > np.asarray(start)[:, None]) & (t <= np.asarray(end)[:, None])
+
+
+def std_rows(t, values, start, end):
+    m = inside(t, start, end)[:, None, :]
+    count = m.sum(axis=-1)
+    mean = np.where(m, values, 0).sum(axis=-1) / np.maximum(count, 1)
+    var = np.where(m, (values - mean[..., None]) ** 2, 0).sum(axis=-1) / np.maximum(count, 1)
+    return np.where(count >= 2, np.sqrt(var), 0)
+
+
+def peak_rows(t, values, start, end):
+    m = inside(t, start, end)[:, None, :]
+    return np.where(m, np.abs(values), 0).max(axis=(1, 2))
+
+
+def drift_rows(t, values, start, end, period=None):
+    m = inside(t, start, end)
+    rows = np.arange(len(t))
+    first = np.argmax(m, axis=1)
+    last = m.shape[1] - 1 - np.argmax(m[:, ::-1], axis=1)
+    delta = values[rows, :, last] - values[rows, :, first]
+    if period is not None:
+        delta = (delta + period / 2) % period - period / 2
+    return np.where((m.sum(axis=1) >= 2)[:, None], delta, 0)
@@ -0,0 +1,105 @@
+'''
+Compact binary batches of shot records for the ingest server (ingest.py).
+
+    MAGIC, zlib(body)
+    body: u16 id length, id, u16 record count, records
+    scalar record: u8 kind, i64 time, u8 field count, (u8 name length, name, f64 value) per field
+    window record: u8 kind, i64 event_time, i64 event_time_buf, u8 axes, u32 n, i64 time[n], f32 points[axes, n],
+                   u8 format length, number format (empty for the default)
+
+Records are the Worker queue messages ('event', 'std', 'drift',
+'acceleration', 'orientation', 'stability'), decoded back into the same
+(cmd, val) form so both ends encode them with lineproto.encode_record.
+'''
+import struct
+import zlib
+import numpy as np
+
+MAGIC = b'SBW1'
+SCALARS = ('event', 'std', 'drift')
+WINDOWS = ('acceleration', 'orientation', 'stability') #append only, the index is the wire kind
+KINDS = SCALARS + WINDOWS
+
+U8 = struct.Struct('<B')
+U16 = struct.Struct('<H')
+SCALAR = struct.Struct('<qB')
+FIELD = struct.Struct('<d')
+WINDOW = struct.Struct('<qqBI')
+
+
+class IngestError(Exception):
+    '''non 2xx answer of the ingest server'''
+    def __init__(self, status):
+        super().__init__(f'ingest: http {status}')
+        self.status = status
+
+
+def encode_batch(id, records):
+    id = id.encode('utf-8')
+    out = [U16.pack(len(id)), id, U16.pack(len(records))]
+    for cmd, val in records:
+        out.append(U8.pack(KINDS.index(cmd)))
+        if cmd in SCALARS:
+            time, d = val
+            out.append(SCALAR.pack(int(time), len(d)))
+            for field, value in d.items():
+                name = field.encode('utf-8')
+                out += [U8.pack(len(name)), name, FIELD.pack(float(value))]
+        else:
+            event_time, event_time_buf, points, time, *fmt = val
+            axes, n = points.shape
+            out.append(WINDOW.pack(int(event_time), int(event_time_buf), axes, n))
+            out.append(np.ascontiguousarray(time, dtype='<i8').tobytes())
+            out.append(np.ascontiguousarray(points, dtype='<f4').tobytes())
+            fmt = fmt[0].encode('ascii') if fmt else b''
+            out += [U8.pack(len(fmt)), fmt]
+    return MAGIC + zlib.compress(b''.join(out))
+
+
+def decode_batch(data):
+    '''returns id, [(cmd, val), ...], raises ValueError on a malformed batch'''
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('wire: bad magic')
+    try:
+        body = zlib.decompress(data[len(MAGIC):])
+        pos = 0
+        (size,) = U16.unpack_from(body, pos)
+        pos += U16.size
+        id = body[pos:pos + size].decode('utf-8')
+        pos += size
+        (count,) = U16.unpack_from(body, pos)
+        pos += U16.size
+
+        records = []
+        for _ in range(count):
+            (kind,) = U8.unpack_from(body, pos)
+            pos += U8.size
+            cmd = KINDS[kind]
+            if cmd in SCALARS:
+                time, n_fields = SCALAR.unpack_from(body, pos)
+                pos += SCALAR.size
+                d = {}
+                for _ in range(n_fields):
+                    (size,) = U8.unpack_from(body, pos)
+                    pos += U8.size
+                    name = body[pos:pos + size].decode('utf-8')
+                    pos += size
+                    (d[name],) = FIELD.unpack_from(body, pos)
+                    pos += FIELD.size
+                records.append((cmd, (time, d)))
+            else:
+                event_time, event_time_buf, axes, n = WINDOW.unpack_from(body, pos)
+                pos += WINDOW.size
+                time = np.frombuffer(body, dtype='<i8', count=n, offset=pos)
+                pos += 8 * n
+                points = np.frombuffer(body, dtype='<f4', count=axes * n, offset=pos).reshape(axes, n)
+                pos += 4 * axes * n
+                (size,) = U8.unpack_from(body, pos)
+                pos += U8.size
+                fmt = body[pos:pos + size].decode('ascii')
+                pos += size
+                val = (event_time, event_time_buf, points, time)
+                records.append((cmd, val + (fmt,) if fmt else val))
+    except (zlib.error, struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError(f'wire: {e}')
+    return id, records
@@ -0,0 +1,270 @@
+import os
+import time
+import datetime
+import threading
+from collections import deque
+from queue import Empty
+
+from mylog import log, QueueLogHandler, logging
+from compat import get_application_dir
+from plyer import uniqueid
+from lineproto import encode_record
+from wire import encode_batch, IngestError
+import policy
+from spool import Spool
+from counts import CountStore
+from history import History
+from archive import ShotArchives
+from metrics import metrics, perf_counter_ns
+from lanequeue import LaneQueue
+from config import *
+
+#the upload stack takes a while to import, it is only loaded once a config validates (load_upload_stack)
+urllib3 = None
+influxdb_client = None
+Point = WritePrecision = None
+
+
+def load_upload_stack():
+    global urllib3, influxdb_client, Point, WritePrecision
+    if influxdb_client is not None:
+        return
+    import urllib3
+    import influxdb_client
+    import influxdb_client.client.write_api
+    from influxdb_client import Point, WritePrecision
+
+
+class Worker:
+    def __init__(self, config):
+        self.q = LaneQueue(WORKER_LANES)
+        self.id = uniqueid.id
+        self.write_api = None
+        self.client = None
+
+        counts_file = os.path.join(get_application_dir(), 'counts.log')
+        legacy = not os.path.isfile(counts_file)
+        self.counts = CountStore(counts_file)
+        if legacy:
+            self.counts.import_legacy(get_application_dir())
+        self.history = History(os.path.join(get_application_dir(), 'history.log'), self.counts)
+        self.day_end = 0
+        self.day_lock = threading.Lock()
+        self.update_day()
+
+        self.archive = None
+        if ARCHIVE_SHOTS:
+            self.archive = ShotArchives(os.path.join(get_application_dir(), 'archive'))
+
+        self.ingest = None
+        valid = 'influx_org' in config and 'influx_bucket' in config and 'influx_token' in config and 'influx_url' in config # and config['influx_token'] != 'token'
+        if config.get('ingest_url') or valid:
+            load_upload_stack()
+            retries = urllib3.Retry(connect=3, read=2, redirect=3)
+        if config.get('ingest_url'):
+            #shots go to the local ingest server (ingest.py), which talks to influx
+            log.debug(f"ingest: {config['ingest_url']}")
+            self.ingest_url = config['ingest_url'].rstrip('/')
+            self.ingest = urllib3.PoolManager(maxsize=1, timeout=10, retries=retries)
+        elif valid:
+            log.debug(f"influx: {config['influx_url']}")
+            self.client = influxdb_client.InfluxDBClient(url=config['influx_url'], token=config['influx_token'], timeout=10, retries=retries, enable_gzip=True)
+            self.bucket = config['influx_bucket']
+            self.org = config['influx_org']
+            self.write_api = self.client.write_api(write_options=influxdb_client.client.write_api.SYNCHRONOUS) #ASYNC does not work due to sem_ impoementation missing
+        else:
+            log.info('influx: configuration is invalid')
+
+        self.online = self.ingest is not None or self.write_api is not None
+        if self.online:
+            self.spool = Spool(os.path.join(get_application_dir(), 'spool'))
+            drain_th = threading.Thread(target=self.drain, daemon=True, name='drain')
+            drain_th.start()
+
+            l = QueueLogHandler(self.q)
+            formatter = logging.Formatter('%(filename)s-%(funcName)s-L%(lineno)d : %(message)s')
+            l.setFormatter(formatter)
+            l.setLevel(logging.INFO)
+            log.addHandler(l)
+
+        self.policies = policy.load_policies(config)
+        self.send_buffer = []
+        self.log_buffer = deque(maxlen=LOG_BUFFER_LEN)
+        self.log_dropped = 0
+        self.log_flush_time = 0
+        self.metrics_time = time.monotonic() + METRICS_INTERVAL
+        do_th = threading.Thread(target=self.do, daemon=True)
+        do_th.start()
+
+    def update_day(self):
+        #reset event count at 0 on new day; called from the UI and the pipeline thread
+        with self.day_lock:
+            self._update_day()
+
+    def _update_day(self):
+        if time.time() >= self.day_end:
+            today = datetime.date.today()
+            self.today = str(today)
+            self.day_end = time.mktime((today + datetime.timedelta(days=1)).timetuple())
+            self.event_count = self.counts.get(self.today)
+
+    def get_count(self, day):
+        return self.counts.get(day)
+
+    def register_event(self):
+        '''count a shot on today, returns the new count'''
+        with self.day_lock:
+            self._update_day()
+            self.event_count = self.counts.increment(self.today)
+            return self.event_count
+
+    def process(self):
+        try:
+            cmd, val = self.q.get(timeout=min(LOG_FLUSH_INTERVAL, METRICS_INTERVAL))
+        except Empty:
+            return
+        t0 = perf_counter_ns()
+        if cmd in ['event', 'std', 'drift', 'orientation', 'acceleration', 'stability']:
+            log.debug(f'{cmd}: time: {val[0]}')
+            if cmd == 'std':
+                #sensor timestamps are not wall clock, the shot was counted on self.today
+                self.history.add(datetime.date.fromisoformat(self.today), list(val[1].values()))
+            if self.ingest is not None:
+                self.send_buffer.append((cmd, val)) #full windows, trimmed and encoded by the ingest server
+            else:
+                self.send_buffer.append(self.encode(cmd, val))
+            metrics.add('encode', perf_counter_ns() - t0)
+        elif cmd == 'archive':
+            if self.archive is not None:
+                self.archive.append(*val)
+        elif cmd == 'flush':
+            if self.online:
+                log.debug(f'{cmd}: {len(self.send_buffer)}')
+                ok = self.write_shots(self.send_buffer) if self.ingest is not None else self.write(self.send_buffer)
+                if ok and self.spool.pending_bytes:
+                    self.spool.resume() #we are back online
+                metrics.add('upload', perf_counter_ns() - t0)
+
+            self.send_buffer = []
+        elif cmd == 'log':
+            if len(self.log_buffer) == self.log_buffer.maxlen:
+                self.log_dropped += 1 #oldest record falls off
+            self.log_buffer.append(val)
+        else:
+            raise Exception("unknown cmd", cmd)
+
+
+    def encode(self, cmd, val):
+        #line protocol of a shot record, windows cut down by the upload policy first
+        if cmd in self.policies:
+            event_time, event_time_buf, points, time = val
+            val = (event_time, event_time_buf) + policy.apply(self.policies[cmd], points, time, event_time_buf)
+        return encode_record(cmd, val, dict(id=self.id))
+
+    @staticmethod
+    def serialize(records):
+        return b'\n'.join(r if isinstance(r, bytes) else r.to_line_protocol().encode('utf-8') for r in records)
+
+    def upload(self, data):
+        #data: line protocol bytes or a list of records
+        if self.ingest is None:
+            self.write_api.write(self.bucket, self.org, data)
+            return
+        if not isinstance(data, bytes):
+            data = self.serialize(data)
+        self.post('/write', data)
+
+    def post(self, path, body):
+        r = self.ingest.request('POST', self.ingest_url + path, body=body, headers={'Content-Type': 'application/octet-stream'})
+        if r.status >= 300:
+            raise IngestError(r.status)
+
+    def drain(self):
+        backoff = SPOOL_BACKOFF_MIN
+        while True:
+            segment = self.spool.peek()
+            if segment is None:
+                self.spool.wait()
+                continue
+            name, data = segment
+            try:
+                if data:
+                    self.upload(data)
+            except (influxdb_client.rest.ApiException, IngestError) as e:
+                if e.status in (400, 422):
+                    #malformed data will never be accepted
+                    log.warning(f'drain: dropping {name}: {e.status}')
+                    self.spool.pop(name, dropped=True)
+                else:
+                    self.spool.backoff(backoff)
+                    backoff = min(backoff * 2, SPOOL_BACKOFF_MAX)
+                continue
+            except Exception as e:
+                #timeouts, dropped connections (urllib3 HTTPError) and anything else: retry later, never end the thread
+                log.debug(f'drain: {e}')
+                self.spool.backoff(backoff)
+                backoff = min(backoff * 2, SPOOL_BACKOFF_MAX)
+                continue
+            self.spool.pop(name)
+            backoff = SPOOL_BACKOFF_MIN
+            log.debug(f'drain: {name} uploaded, pending: {self.spool.pending_bytes} dropped: {self.spool.dropped_bytes}')
+
+    def write(self, records):
+        #returns False if the records had to be spooled
+        try:
+            self.upload(records)
+            return True
+        except (influxdb_client.rest.ApiException, IngestError, urllib3.exceptions.HTTPError):
+            self.spool.put(self.serialize(records))
+            return False
+
+    def write_shots(self, records):
+        #raw shot records as one binary batch, spooled as line protocol if the ingest server is unreachable
+        try:
+            self.post('/shots', encode_batch(self.id, records))
+            return True
+        except (IngestError, urllib3.exceptions.HTTPError):
+            self.spool.put(b'\n'.join(self.encode(cmd, val) for cmd, val in records))
+            return False
+
+    def flush_log(self):
+        if not self.online:
+            self.log_buffer.clear()
+            return
+        points = [Point('log').tag('id', self.id).time(int(val['created'] * 1e9), WritePrecision.NS).tag('levelno', val['levelno']).field('msg', val['msg'])
+                  for val in self.log_buffer]
+        self.log_buffer.clear()
+        self.write(points)
+
+    def export_metrics(self):
+        stages = metrics.snapshot()
+        if not self.online:
+            return
+        now = time.time_ns()
+        points = []
+        for stage, summary in stages.items():
+            point = Point('perf').tag('id', self.id).tag('stage', stage).time(now, WritePrecision.NS)
+            for field, value in summary.items():
+                point.field(field, value)
+            points.append(point)
+        for lane, (depth, dropped) in self.q.stats().items():
+            points.append(Point('queue').tag('id', self.id).tag('lane', lane).field('depth', depth).field('dropped', dropped).time(now, WritePrecision.NS))
+        self.write(points)
+
+    def do(self):
+        while True:
+            try:
+                self.process()
+                if self.log_buffer and time.monotonic() >= self.log_flush_time:
+                    self.log_flush_time = time.monotonic() + LOG_FLUSH_INTERVAL
+                    self.flush_log()
+                if time.monotonic() >= self.metrics_time:
+                    self.metrics_time = time.monotonic() + METRICS_INTERVAL
+                    self.export_metrics()
+            except Exception as e:
+                log.warning(f'do: {e}')
+
+    def stop(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None